@@ -0,0 +1,128 @@
+"""
+Fetch Orchestrator - Morpheus AI
+
+Runs independent fetches (mail accounts, briefing sections) at the same
+time under one global deadline. Whatever hasn't answered by the deadline
+is reported as timed out and left behind, so one slow IMAP or Gmail
+account can't stall the 07:00 briefing or a scan. Per-task latency goes to
+stderr.
+
+Mail is fetched per account when mail_bridge exposes
+list_accounts() and fetch_recent_emails(account, max_results=..., since=...),
+and through fetch_all_recent_emails() as a single task otherwise.
+"""
+
+import inspect
+import os
+import sys
+import threading
+import time
+
+DEADLINE = float(os.environ.get("FETCH_DEADLINE", 45))
+# Task name for mail fetched in one go, when the bridge can't list accounts
+ALL_ACCOUNTS = "email"
+
+
+def run_concurrently(tasks, deadline=DEADLINE):
+    """Run {name: fn()} at once on daemon threads and wait at most `deadline`
+    seconds in total.
+
+    Returns (results, errors, latency): results[name] for tasks that
+    finished, errors[name] ("timed out" or "error: ...") for the rest and
+    latency[name] in seconds for all of them. Tasks still running at the
+    deadline are abandoned; daemon threads don't hold up interpreter exit.
+    """
+    results, errors, latency = {}, {}, {}
+    pending = set(tasks)
+    done = threading.Condition()
+    started = time.perf_counter()
+
+    def run(name, fn):
+        try:
+            value, error = fn(), None
+        except Exception as e:
+            value, error = None, f"error: {e}"
+        with done:
+            if name not in pending:
+                return  # already reported as timed out
+            latency[name] = time.perf_counter() - started
+            if error:
+                errors[name] = error
+            else:
+                results[name] = value
+            pending.discard(name)
+            done.notify_all()
+
+    for name, fn in tasks.items():
+        threading.Thread(target=run, args=(name, fn), name=f"fetch-{name}", daemon=True).start()
+
+    with done:
+        while pending:
+            remaining = started + deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            done.wait(remaining)
+        for name in pending:
+            errors[name] = "timed out"
+            latency[name] = time.perf_counter() - started
+        pending.clear()
+
+    for name in tasks:
+        outcome = errors.get(name) or "ok"
+        print(f"[fetch] {name}: {latency[name]:.2f}s ({outcome})", file=sys.stderr)
+    return results, errors, latency
+
+
+def marker(kind, name, error):
+    """'(account X timed out)' / '(calendar error: ...)' style note."""
+    return f"({kind} {name} {error})" if kind else f"({name} {error})"
+
+
+def _accepts(fn, parameter):
+    try:
+        return parameter in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _account_name(account):
+    if isinstance(account, dict):
+        return f"{account.get('type', 'unknown')}:{account.get('id') or account.get('account', 'unknown')}"
+    if isinstance(account, (tuple, list)) and len(account) == 2:
+        return f"{account[0]}:{account[1]}"
+    return str(account)
+
+
+def mail_tasks(bridge, max_results_per_account, since=None):
+    """{name: fn} fetching recent mail, one task per account when the
+    bridge supports it. `since` is {"<type>:<account>": datetime}."""
+    list_accounts = getattr(bridge, "list_accounts", None)
+    fetch_one = getattr(bridge, "fetch_recent_emails", None)
+    if list_accounts is None or fetch_one is None:
+        fetch_all = bridge.fetch_all_recent_emails
+        kwargs = {"max_results_per_account": max_results_per_account}
+        if since is not None and _accepts(fetch_all, "since"):
+            kwargs["since"] = since
+        return {ALL_ACCOUNTS: lambda: fetch_all(**kwargs)}
+
+    tasks = {}
+    for account in list_accounts():
+        name = _account_name(account)
+        kwargs = {"max_results": max_results_per_account}
+        if since and name in since and _accepts(fetch_one, "since"):
+            kwargs["since"] = since[name]
+        tasks[name] = lambda account=account, kwargs=kwargs: fetch_one(account, **kwargs)
+    return tasks
+
+
+def fetch_all_emails(bridge, max_results_per_account, since=None, deadline=DEADLINE):
+    """Recent mail from every account, fetched concurrently.
+
+    Returns (emails, markers): whatever arrived in time, plus one
+    "(account X timed out)" / "(account X error: ...)" note per account
+    that didn't, or "(email timed out)" when all mail was one fetch.
+    """
+    results, errors, _ = run_concurrently(mail_tasks(bridge, max_results_per_account, since), deadline)
+    emails = [e for batch in results.values() for e in (batch or [])]
+    return emails, [marker(None if name == ALL_ACCOUNTS else "account", name, error)
+                    for name, error in errors.items()]
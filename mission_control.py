@@ -1,15 +1,45 @@
 import os
 import json
+import queue
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import ollama_client
+from mission_store import MissionStore, is_mission_file, new_mission, submit_missions
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # No watchdog: fall back to polling the directory listing
+    FileSystemEventHandler = object
+    Observer = None
 
 # Configuration
 MISSION_DIR = os.environ.get("MISSION_CONTROL_MISSIONS_DIR", "missions")
 LIBRARY_DIR = "library"
-# Use host.docker.internal if we suspect it might run in a container,
-# but localhost is usually fine for a host-resident script.
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL = "llama3.1:8b"
+# LLM-backed handlers go through ollama_client. This script runs on the
+# host, so Ollama is on localhost unless OLLAMA_URL/OLLAMA_API_URL say
+# otherwise.
+ollama_client.DEFAULT_URL = "http://localhost:11434"
+
+# Polling backend: how often to stat the directory. With watchdog this is
+# only a safety-net rescan for events the OS dropped.
+POLL_INTERVAL = float(os.environ.get("MISSION_CONTROL_POLL_INTERVAL", 2))
+RESCAN_INTERVAL = 60
+
+# Worker pool: missions accepted but not finished (queued + running). When
+# it is full the watcher blocks, which holds new files on disk until a slot
+# frees up. Handlers get HANDLER_TIMEOUT seconds per attempt and MAX_RETRIES
+# retries, RETRY_BACKOFF * 2^n seconds apart, unless they declare their own.
+QUEUE_SIZE = int(os.environ.get("MISSION_CONTROL_QUEUE_SIZE", 100))
+HANDLER_TIMEOUT = float(os.environ.get("MISSION_CONTROL_HANDLER_TIMEOUT", 300))
+MAX_RETRIES = int(os.environ.get("MISSION_CONTROL_MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.environ.get("MISSION_CONTROL_RETRY_BACKOFF", 5))
+METRICS_FILE = os.path.join("logs", "mission_metrics.json")
 
 
 logging.basicConfig(
@@ -21,6 +51,251 @@ logging.basicConfig(
     ]
 )
 
+store = MissionStore(MISSION_DIR)
+
+
+HANDLERS = {}
+
+_slots = threading.BoundedSemaphore(QUEUE_SIZE)
+# Runs run_mission() for every accepted mission; the handler calls themselves
+# run on each action's own pool
+_dispatcher = ThreadPoolExecutor(max_workers=QUEUE_SIZE, thread_name_prefix="mission-dispatch")
+_in_flight = set()
+# Pending missions with no registered handler (warned about once)
+_unhandled = set()
+_metrics_lock = threading.Lock()
+# action -> counters; latency is queue wait + run time, in milliseconds
+_metrics = {}
+
+
+class Handler:
+    """A registered action: its function, limits and private thread pool."""
+
+    def __init__(self, action, fn, concurrency, timeout, retries):
+        self.action = action
+        self.fn = fn
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.executor = ThreadPoolExecutor(max_workers=concurrency,
+                                           thread_name_prefix=f"mission-{action}")
+
+
+def handler(action, concurrency=1, timeout=HANDLER_TIMEOUT, retries=MAX_RETRIES):
+    """Register fn(mission) -> new status as the handler for an action.
+
+    At most `concurrency` calls of this action run at once (timed-out calls
+    still running included), on the action's own threads, so a slow action
+    never holds up the others.
+    """
+    def register(fn):
+        HANDLERS[action] = Handler(action, fn, concurrency, timeout, retries)
+        return fn
+    return register
+
+
+@handler("save_research", concurrency=4)
+def save_research(mission):
+    logging.info(f"✅ Research archived: {mission.get('data', {}).get('title')}")
+    return "completed"
+
+
+@handler("scout_x", concurrency=1)
+def scout_x(mission):
+    msg = f"📡 [HANDOFF] Scout triggered for '{mission.get('data', {}).get('topic')}'"
+    logging.info(msg)
+    return "notified_cloud"
+
+
+def _count(action, **deltas):
+    with _metrics_lock:
+        counters = _metrics.setdefault(action, {
+            "queued": 0, "running": 0, "completed": 0, "failed": 0, "retries": 0,
+            "timeouts": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0})
+        for key, delta in deltas.items():
+            if key == "latency_ms":
+                counters["latency_ms_total"] += delta
+                counters["latency_ms_max"] = max(counters["latency_ms_max"], delta)
+            else:
+                counters[key] += delta
+
+
+def metrics():
+    """Queue depth and per-action counters and latency (ms)."""
+    with _metrics_lock:
+        actions = {}
+        for action, c in _metrics.items():
+            done = c["completed"] + c["failed"]
+            actions[action] = {key: value for key, value in c.items() if key != "latency_ms_total"}
+            actions[action]["latency_ms_avg"] = c["latency_ms_total"] / done if done else None
+        return {"queue_depth": sum(c["queued"] for c in _metrics.values()),
+                "in_flight": len(_in_flight),
+                "capacity": QUEUE_SIZE,
+                "actions": actions}
+
+
+def report_metrics():
+    snapshot = metrics()
+    try:
+        with open(METRICS_FILE, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2)
+    except OSError as e:
+        logging.error(f"Could not write {METRICS_FILE}: {e}")
+    if snapshot["actions"]:
+        parts = [f"{action} {c['completed']} ok/{c['failed']} failed, "
+                 f"avg {c['latency_ms_avg'] or 0:.0f}ms"
+                 for action, c in sorted(snapshot["actions"].items())]
+        logging.info(f"📊 Queue {snapshot['queue_depth']} waiting, "
+                     f"{snapshot['in_flight']} in flight | " + " | ".join(parts))
+
+
+def _attempt(h, mission):
+    """Run one attempt of h.fn(mission) on the action's pool and give up
+    waiting h.timeout seconds after it starts.
+
+    Python threads can't be killed, so an attempt that times out keeps its
+    worker until it returns (its result is ignored). Retries queue behind
+    it, so no more than h.concurrency calls of an action ever run at once.
+    The mission counts as queued until a worker picks the call up, and as
+    running until the call returns.
+    """
+    started = threading.Event()
+
+    def call():
+        _count(h.action, queued=-1, running=1)
+        started.set()
+        try:
+            return h.fn(mission)
+        finally:
+            _count(h.action, running=-1)
+
+    future = h.executor.submit(call)
+    started.wait()
+    try:
+        return future.result(timeout=h.timeout)
+    except FutureTimeout:
+        raise TimeoutError(f"timed out after {h.timeout:g}s")
+
+
+def run_mission(h, filepath, mission, accepted):
+    """Worker body: run the handler with retries, then save the outcome."""
+    filename = os.path.basename(filepath)
+    logging.info(f"🚀 Processing Mission: {h.action}...")
+    try:
+        error = None
+        for attempt in range(h.retries + 1):
+            if attempt:
+                _count(h.action, retries=1)
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+                _count(h.action, queued=1)
+            try:
+                status = _attempt(h, mission)
+                error = None
+                break
+            except TimeoutError as e:
+                _count(h.action, timeouts=1)
+                error = str(e)
+            except Exception as e:
+                error = str(e)
+            logging.warning(f"⚠️ {h.action} attempt {attempt + 1}/{h.retries + 1} "
+                            f"failed for {filename}: {error}")
+
+        if error is None:
+            if status:
+                mission["status"] = status
+            _count(h.action, completed=1)
+        else:
+            mission["status"] = "failed"
+            mission["error"] = error
+            _count(h.action, failed=1)
+            logging.error(f"❌ {h.action} gave up on {filename}: {error}")
+
+        # Save updated status (completed missions move to the archive)
+        try:
+            store.save(filepath, mission)
+        except OSError as e:
+            logging.error(f"Error saving {filename}: {e}")
+    finally:
+        _count(h.action, latency_ms=(time.perf_counter() - accepted) * 1000)
+        with _metrics_lock:
+            _in_flight.discard(filepath)
+        _slots.release()
+
+
+def handle_mission(filepath):
+    """Queue a pending mission on its action's workers.
+
+    The path is claimed before the file is read, so a mission that is
+    already queued or running is never picked up a second time, and one
+    whose worker has just finished is read with its new status.
+    """
+    with _metrics_lock:
+        if filepath in _in_flight:
+            return
+        _in_flight.add(filepath)
+    accepted = False
+    try:
+        mission = store.load(filepath)
+        if mission is None or mission.get("status") != "pending":
+            return
+
+        action = mission.get("action")
+        h = HANDLERS.get(action)
+        if h is None:
+            if filepath not in _unhandled:
+                _unhandled.add(filepath)
+                logging.warning(f"⚠️ No handler for action '{action}' ({os.path.basename(filepath)})")
+            return
+
+        # Backpressure: wait for a free slot rather than queueing without bound
+        if not _slots.acquire(blocking=False):
+            logging.warning(f"⏳ Mission queue full ({QUEUE_SIZE}), waiting for a slot...")
+            _slots.acquire()
+        _count(action, queued=1)
+        _dispatcher.submit(run_mission, h, filepath, mission, time.perf_counter())
+        accepted = True
+    finally:
+        if not accepted:
+            with _metrics_lock:
+                _in_flight.discard(filepath)
+
+
+def submit(missions):
+    """In-process submission: write missions (dicts from new_mission) to
+    disk and queue them straight away, without waiting for the watcher.
+
+    A mission the watcher also sees is already in flight and is skipped
+    there, so each mission is handled once. Returns the mission ids.
+    """
+    for path in submit_missions(missions, MISSION_DIR):
+        store.refresh(path)
+        handle_mission(path)
+    return [mission["id"] for mission in missions]
+
+
+def submit_mission(action, data=None, **fields):
+    """Submit one mission in-process. Returns its id."""
+    return submit([new_mission(action, data, **fields)])[0]
+
+
+def shutdown():
+    """Let queued and running missions finish."""
+    _dispatcher.shutdown(wait=True)
+    for h in HANDLERS.values():
+        h.executor.shutdown(wait=True)
+    report_metrics()
+
+
+def process_mission_file(filepath):
+    """Index a new or changed mission file and queue it if it is pending."""
+    try:
+        mission = store.refresh(filepath)
+    except OSError as e:
+        logging.error(f"Error reading {os.path.basename(filepath)}: {e}")
+        return
+    if mission is not None and mission.get("status") == "pending":
+        handle_mission(filepath)
+
 
 def process_pending_missions():
     if not os.path.exists(MISSION_DIR):
@@ -30,43 +305,93 @@ def process_pending_missions():
             logging.error(f"Could not create mission directory: {e}")
             return
 
-    for filename in os.listdir(MISSION_DIR):
-        if filename.endswith(".json"):
-            filepath = os.path.join(MISSION_DIR, filename)
+    # Work comes from the status index, not from what changed since the
+    # last look: another process (the briefing, mission_store.py) may have
+    # indexed a new file first, and a restart must pick up where it left off
+    for m in store.pending(("pending",)):
+        if m["path"] in _in_flight:
+            continue
+        try:
+            handle_mission(m["path"])
+        except Exception as e:
+            logging.error(f"Error processing {m['name']}: {e}")
+
+
+class MissionEventHandler(FileSystemEventHandler):
+    """Queues mission paths on write-complete and rename events.
+
+    Linux (inotify) reports close-after-write; Windows and macOS only report
+    created/modified, which may fire mid-write, so those are queued too and a
+    partial file is simply picked up again on its next event.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def _queue(self, path):
+        if is_mission_file(path):
+            self.events.put(os.path.join(MISSION_DIR, os.path.basename(path)))
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path)
+
+    def on_moved(self, event):
+        # Atomic submissions: temp file renamed onto the final name
+        if not event.is_directory:
+            self._queue(event.dest_path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path)
+
+
+def watch():
+    """Process missions as they arrive, until interrupted."""
+    process_pending_missions()
+
+    if Observer is None:
+        logging.info(f"👀 watchdog not installed; polling every {POLL_INTERVAL}s")
+        last_report = time.monotonic()
+        try:
+            while True:
+                time.sleep(POLL_INTERVAL)
+                process_pending_missions()
+                if time.monotonic() - last_report >= RESCAN_INTERVAL:
+                    report_metrics()
+                    last_report = time.monotonic()
+        finally:
+            shutdown()
+
+    events = queue.Queue()
+    observer = Observer()
+    observer.schedule(MissionEventHandler(events), MISSION_DIR, recursive=False)
+    observer.start()
+    logging.info("👀 Watching for mission events")
+    last_scan = time.monotonic()
+    try:
+        while True:
             try:
-                # Wait for file write to complete
-                time.sleep(0.5)
-
-                with open(filepath, "r+", encoding="utf-8") as f:
-                    try:
-                        mission = json.load(f)
-                    except json.JSONDecodeError:
-                        logging.warning(f"⚠️ Partial JSON in {filename}, skipping...")
-                        continue
-
-                    if mission.get("status") == "pending":
-                        action = mission.get("action")
-                        data = mission.get("data", {})
-
-                        logging.info(f"🚀 Processing Mission: {action}...")
-
-                        # Local Autonomous Logic
-                        if action == "save_research":
-                            mission["status"] = "completed"
-                            logging.info(f"✅ Research archived: {data.get('title')}")
-
-                        elif action == "scout_x":
-                            if mission.get("status") == "pending":
-                                mission["status"] = "notified_cloud"
-                                msg = f"📡 [HANDOFF] Scout triggered for '{data.get('topic')}'"
-                                logging.info(msg)
-
-                        # Save updated status
-                        f.seek(0)
-                        json.dump(mission, f, indent=2)
-                        f.truncate()
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
+                filepath = events.get(timeout=RESCAN_INTERVAL)
+            except queue.Empty:
+                filepath = None
+            if filepath:
+                try:
+                    process_mission_file(filepath)
+                except Exception as e:
+                    logging.error(f"Error processing {os.path.basename(filepath)}: {e}")
+            if time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                process_pending_missions()
+                report_metrics()
+                last_scan = time.monotonic()
+    finally:
+        observer.stop()
+        observer.join()
+        shutdown()
 
 
 if __name__ == "__main__":
@@ -80,7 +405,5 @@ if __name__ == "__main__":
     time.sleep(15)
 
     logging.info("🦾 Mission Control is online and watching missions/...")
-    while True:
-        process_pending_missions()
-        time.sleep(5)  # responsive 5s loop
-
+    os.makedirs(MISSION_DIR, exist_ok=True)
+    watch()
@@ -0,0 +1,332 @@
+"""
+Mission Store - Morpheus AI
+
+Status index over the missions/ directory, so callers can ask for pending
+work without opening every mission file ever written.
+
+    missions/*.json               active missions (pending, notified_cloud, ...)
+    missions/archive/YYYY-MM/     completed missions, moved out of the way
+    missions/.index.db            SQLite index: file -> action, task, status
+
+The JSON files stay the source of truth (producers keep writing them as
+before); the index is a cache that sync() brings up to date by stat-ing the
+active directory only. Because completed missions are archived, that
+directory holds roughly the outstanding work, and pending() costs O(pending)
+rather than O(all missions ever). Deleting .index.db is always safe: the
+next sync() rebuilds it from the active files.
+
+Producers submit through submit_mission()/submit_missions(): ids carry a
+random suffix so concurrent submissions never share a file name, and each
+file is written under a dot-prefixed temp name and renamed into place, so
+a reader never sees a half-written mission.
+
+    from mission_store import submit_mission
+    submit_mission("scout_x", {"topic": "Llama 4", "reasoning": "..."})
+
+Usage:
+  python mission_store.py             # Counts by status
+  python mission_store.py --pending   # List outstanding missions
+  python mission_store.py --rebuild   # Drop and rebuild the index
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+
+MISSION_DIR = os.environ.get("MISSION_CONTROL_MISSIONS_DIR", "missions")
+ARCHIVE_DIR = "archive"
+INDEX_NAME = ".index.db"
+
+# Statuses that are finished with: their files move to the archive
+ARCHIVE_STATUSES = ("completed",)
+OPEN_STATUSES = ("pending", "notified_cloud")
+
+
+def is_mission_file(path):
+    # Producers and write_mission() stage files as .<name>.tmp before renaming
+    name = os.path.basename(path)
+    return name.endswith(".json") and not name.startswith(".")
+
+
+def write_mission(filepath, mission):
+    """Replace a mission file atomically (temp file + rename)."""
+    directory, name = os.path.split(filepath)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(mission, f, indent=2)
+    os.replace(tmp_path, filepath)
+
+
+def new_mission(action, data=None, **fields):
+    """A pending mission dict with a collision-free id."""
+    now = datetime.datetime.now()
+    mission_id = f"{action}_{now.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    mission = {
+        "id": mission_id,
+        "action": action,
+        "status": "pending",
+        "data": data or {},
+        "created_at": now.isoformat()
+    }
+    mission.update(fields)
+    return mission
+
+
+def submit_missions(missions, mission_dir=MISSION_DIR):
+    """Submit several missions (dicts from new_mission) as one batch.
+
+    All files are staged under temp names first and only then renamed
+    into place, so a failed batch leaves no partial missions behind.
+    Returns the final paths.
+    """
+    os.makedirs(mission_dir, exist_ok=True)
+    staged = []
+    try:
+        for mission in missions:
+            path = os.path.join(mission_dir, f"{mission['id']}.json")
+            tmp_path = os.path.join(mission_dir, f".{mission['id']}.json.tmp")
+            staged.append((tmp_path, path))
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(mission, f, indent=2)
+    except BaseException:
+        for tmp_path, _ in staged:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        raise
+    for tmp_path, path in staged:
+        os.replace(tmp_path, path)
+    return [path for _, path in staged]
+
+
+def submit_mission(action, data=None, mission_dir=MISSION_DIR, **fields):
+    """Write one pending mission atomically. Returns its id."""
+    mission = new_mission(action, data, **fields)
+    submit_missions([mission], mission_dir)
+    return mission["id"]
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class MissionStore:
+    """Safe to share between threads; calls are serialised."""
+
+    def __init__(self, mission_dir=MISSION_DIR):
+        self.mission_dir = mission_dir
+        self.archive_dir = os.path.join(mission_dir, ARCHIVE_DIR)
+        self.index_path = os.path.join(mission_dir, INDEX_NAME)
+        self._conn = None
+        self._lock = threading.RLock()
+
+    @_locked
+    def connect(self):
+        if self._conn is None:
+            os.makedirs(self.mission_dir, exist_ok=True)
+            # Default rollback journal: the directory is shared between the
+            # host and the container, where WAL's shared memory doesn't work
+            self._conn = sqlite3.connect(self.index_path, timeout=10, check_same_thread=False)
+            try:
+                self._init_schema()
+            except sqlite3.DatabaseError:
+                # A corrupt cache: start over, sync() refills it
+                self._conn.close()
+                os.remove(self.index_path)
+                self._conn = sqlite3.connect(self.index_path, timeout=10, check_same_thread=False)
+                self._init_schema()
+        return self._conn
+
+    def _init_schema(self):
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS missions (
+                name TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                action TEXT,
+                task TEXT,
+                status TEXT,
+                mtime_ns INTEGER,
+                size INTEGER,
+                archived INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_missions_status ON missions(archived, status);
+        ''')
+
+    @_locked
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def path_for(self, name):
+        return os.path.join(self.mission_dir, name)
+
+    def _record(self, name, path, mission, signature, archived=False):
+        self.connect().execute('''
+            INSERT OR REPLACE INTO missions
+                (name, path, action, task, status, mtime_ns, size, archived, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (name, path, mission.get("action"), mission.get("task"), mission.get("status"),
+              signature[0], signature[1], int(archived)))
+
+    @_locked
+    def sync(self):
+        """Bring the index up to date with the active directory.
+
+        Only files that are new or changed since they were last indexed are
+        opened. Files still being written (partial JSON) are left for the
+        next sync. Finished missions found here are archived on the way.
+
+        The index is a status cache shared by every process, not a work
+        queue: "changed since indexed" says nothing about whether anyone
+        has acted on a mission, so consumers take work from pending().
+        """
+        conn = self.connect()
+        known = {name: (mtime_ns, size) for name, mtime_ns, size in
+                 conn.execute('SELECT name, mtime_ns, size FROM missions WHERE archived = 0')}
+        changed, present = [], set()
+        with os.scandir(self.mission_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not is_mission_file(entry.name):
+                    continue
+                present.add(entry.name)
+                st = entry.stat()
+                signature = (st.st_mtime_ns, st.st_size)
+                if known.get(entry.name) == signature:
+                    continue
+                mission = self._read(entry.path)
+                if mission is not None:
+                    changed.append((entry.path, mission, signature))
+
+        with conn:
+            # Files removed by hand (or archived by another process)
+            gone = [(name,) for name in known if name not in present]
+            conn.executemany('DELETE FROM missions WHERE name = ? AND archived = 0', gone)
+            for path, mission, signature in changed:
+                self._record(os.path.basename(path), path, mission, signature)
+        for path, mission, _ in changed:
+            if mission.get("status") in ARCHIVE_STATUSES:
+                self.archive(path, mission)
+
+    @_locked
+    def refresh(self, path):
+        """Index one file after a change event. Returns the mission as it is
+        now, or None if it is unreadable, gone or has just been archived."""
+        name = os.path.basename(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        mission = self._read(path)
+        if mission is None:
+            return None
+        with self.connect():
+            self._record(name, path, mission, signature)
+        if mission.get("status") in ARCHIVE_STATUSES:
+            self.archive(path, mission)
+            return None
+        return mission
+
+    def load(self, path):
+        """The mission in an active file, or None if it can't be read."""
+        return self._read(path)
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                mission = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # Still being written in place; its next change brings it back
+            return None
+        except FileNotFoundError:
+            return None
+        return mission if isinstance(mission, dict) else None
+
+    @_locked
+    def save(self, path, mission):
+        """Write a mission back and index it; finished missions are archived."""
+        if mission.get("status") in ARCHIVE_STATUSES:
+            return self.archive(path, mission)
+        write_mission(path, mission)
+        st = os.stat(path)
+        with self.connect():
+            self._record(os.path.basename(path), path, mission, (st.st_mtime_ns, st.st_size))
+        return path
+
+    @_locked
+    def archive(self, path, mission):
+        """Move a finished mission into archive/YYYY-MM/. Returns its new path."""
+        month = datetime.datetime.now().strftime("%Y-%m")
+        directory = os.path.join(self.archive_dir, month)
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.basename(path)
+        target = os.path.join(directory, name)
+        write_mission(target, mission)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        st = os.stat(target)
+        with self.connect():
+            self._record(name, target, mission, (st.st_mtime_ns, st.st_size), archived=True)
+        return target
+
+    @_locked
+    def pending(self, statuses=OPEN_STATUSES):
+        """Outstanding missions as dicts (name, path, action, task, status),
+        oldest file first."""
+        self.sync()
+        marks = ",".join("?" * len(statuses))
+        rows = self.connect().execute(f'''
+            SELECT name, path, action, task, status FROM missions
+            WHERE archived = 0 AND status IN ({marks})
+            ORDER BY mtime_ns
+        ''', tuple(statuses)).fetchall()
+        keys = ("name", "path", "action", "task", "status")
+        return [dict(zip(keys, row)) for row in rows]
+
+    @_locked
+    def counts(self):
+        self.sync()
+        return dict(self.connect().execute(
+            'SELECT status, COUNT(*) FROM missions GROUP BY status').fetchall())
+
+    @_locked
+    def rebuild(self):
+        """Forget the index of active files and re-read them."""
+        with self.connect():
+            self._conn.execute('DELETE FROM missions WHERE archived = 0')
+        self.sync()
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="Morpheus Mission Store")
+    parser.add_argument("--dir", default=MISSION_DIR, help="Missions directory")
+    parser.add_argument("--pending", action="store_true", help="List outstanding missions")
+    parser.add_argument("--rebuild", action="store_true", help="Drop and rebuild the index")
+    args = parser.parse_args()
+
+    store = MissionStore(args.dir)
+    if args.rebuild:
+        store.rebuild()
+        print("🔄 Index rebuilt.")
+    if args.pending:
+        for m in store.pending():
+            print(f"• [{m['status']}] {m['task'] or m['action'] or m['name']}")
+    else:
+        for status, count in sorted(store.counts().items(), key=lambda item: str(item[0])):
+            print(f"{status}: {count}")
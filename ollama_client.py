@@ -0,0 +1,372 @@
+"""
+Ollama Client - Morpheus AI
+
+One client for every script that talks to the local model (mission_control,
+the urgent-email scanner, the security audit):
+
+- a pooled HTTP session, so repeated calls reuse the connection
+- a global concurrency cap (OLLAMA_MAX_CONCURRENCY, default 1): slots are
+  lock files shared by every process on the machine, so parallel cron jobs
+  queue for the single local model instead of thrashing it
+- keep_alive on every request (OLLAMA_KEEP_ALIVE, default 30m) so the model
+  isn't unloaded and reloaded between jobs
+- streaming, and an asyncio API
+- per-call timing: queue wait, total time and Ollama's own load/eval times
+
+    import ollama_client
+    ollama_client.generate("Say hi")
+    for piece in ollama_client.generate_stream("Tell me a story"):
+        print(piece, end="")
+    await ollama_client.agenerate("Say hi")
+
+Configuration: OLLAMA_URL (server, e.g. http://localhost:11434; the older
+OLLAMA_API_URL and full .../api/generate URLs are accepted too), MODEL_NAME.
+With neither URL set, DEFAULT_URL is used: the Docker host, unless the
+importing script (e.g. mission_control on the host) sets another.
+
+Usage:
+  python ollama_client.py "prompt" [--stream]   # One call against the real server
+  python ollama_client.py --selftest            # Exercise the client against a local stub server
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the cap only covers threads of this process
+    fcntl = None
+
+# Server when neither OLLAMA_URL nor OLLAMA_API_URL is set
+DEFAULT_URL = "http://host.docker.internal:11434"
+MODEL = os.environ.get("MODEL_NAME", "llama3.1:8b")
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", 1))
+LOCK_DIR = os.environ.get("OLLAMA_LOCK_DIR", os.path.join(tempfile.gettempdir(), "morpheus-ollama"))
+# Longest a call waits for a slot before giving up
+QUEUE_TIMEOUT = float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", 600))
+CONNECT_TIMEOUT = 3
+
+_session = None
+_session_lock = threading.Lock()
+_local_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_stats_lock = threading.Lock()
+
+# Totals since import, and the last 100 calls
+stats = {"calls": 0, "errors": 0, "wait_s": 0.0, "total_s": 0.0, "load_s": 0.0}
+calls = deque(maxlen=100)
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+def base_url():
+    """Server root from OLLAMA_URL / OLLAMA_API_URL, whichever is set."""
+    url = os.environ.get("OLLAMA_URL") or os.environ.get("OLLAMA_API_URL") or DEFAULT_URL
+    url = url.rstrip("/")
+    for suffix in ("/api/generate", "/api/chat", "/api"):
+        if url.endswith(suffix):
+            return url[:-len(suffix)]
+    return url
+
+
+def get_session():
+    """The process's pooled session, created on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(4, MAX_CONCURRENCY * 2))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def _try_lock_file():
+    """Take any free cross-process slot. Returns its open file or None."""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    for i in range(MAX_CONCURRENCY):
+        handle = open(os.path.join(LOCK_DIR, f"slot-{i}.lock"), "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return handle
+        except OSError:
+            handle.close()
+    return None
+
+
+@contextmanager
+def slot(timeout=QUEUE_TIMEOUT):
+    """Hold one of the MAX_CONCURRENCY model slots. Yields the seconds spent
+    waiting for it."""
+    started = time.perf_counter()
+    if not _local_slots.acquire(timeout=timeout):
+        raise OllamaError(f"no Ollama slot free after {timeout:g}s")
+    handle = None
+    try:
+        if fcntl is not None:
+            delay = 0.01
+            while (handle := _try_lock_file()) is None:
+                if time.perf_counter() - started > timeout:
+                    raise OllamaError(f"no Ollama slot free after {timeout:g}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+        yield time.perf_counter() - started
+    finally:
+        if handle is not None:
+            handle.close()  # releases the flock
+        _local_slots.release()
+
+
+def _payload(prompt, model, options, format, stream, keep_alive, system):
+    payload = {
+        "model": model or MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": KEEP_ALIVE if keep_alive is None else keep_alive,
+    }
+    if options:
+        payload["options"] = options
+    if format:
+        payload["format"] = format
+    if system:
+        payload["system"] = system
+    return payload
+
+
+def _record(model, wait_s, total_s, reply=None, error=None):
+    """Add one call's timing to the stats. Ollama reports durations in ns."""
+    reply = reply or {}
+    entry = {
+        "model": model,
+        "wait_ms": wait_s * 1000,
+        "total_ms": total_s * 1000,
+        "load_ms": reply.get("load_duration", 0) / 1e6,
+        "eval_tokens": reply.get("eval_count", 0),
+        "eval_ms": reply.get("eval_duration", 0) / 1e6,
+        "error": error,
+    }
+    with _stats_lock:
+        calls.append(entry)
+        stats["calls"] += 1
+        stats["errors"] += error is not None
+        stats["wait_s"] += wait_s
+        stats["total_s"] += total_s
+        stats["load_s"] += entry["load_ms"] / 1000
+
+
+def generate(prompt, model=None, options=None, format=None, timeout=120,
+             keep_alive=None, system=None):
+    """Complete a prompt and return the response text.
+
+    Raises OllamaError if the server can't be reached or answers with an
+    error; callers decide whether that is fatal.
+    """
+    payload = _payload(prompt, model, options, format, False, keep_alive, system)
+    started = time.perf_counter()
+    wait_s = 0.0
+    try:
+        with slot() as wait_s:
+            resp = get_session().post(f"{base_url()}/api/generate", json=payload,
+                                      timeout=(CONNECT_TIMEOUT, timeout))
+            resp.raise_for_status()
+            reply = resp.json()
+    except (requests.exceptions.RequestException, ValueError, OllamaError) as e:
+        _record(payload["model"], wait_s, time.perf_counter() - started, error=str(e))
+        if isinstance(e, OllamaError):
+            raise
+        raise OllamaError(str(e)) from e
+    _record(payload["model"], wait_s, time.perf_counter() - started, reply)
+    return reply.get("response", "")
+
+
+def generate_stream(prompt, model=None, options=None, format=None, timeout=120,
+                    keep_alive=None, system=None):
+    """Yield the response text piece by piece as the model produces it.
+
+    The slot is held until the stream ends or the generator is closed.
+    """
+    payload = _payload(prompt, model, options, format, True, keep_alive, system)
+    started = time.perf_counter()
+    wait_s = 0.0
+    final = {}
+    error = None
+    try:
+        with slot() as wait_s:
+            with get_session().post(f"{base_url()}/api/generate", json=payload, stream=True,
+                                    timeout=(CONNECT_TIMEOUT, timeout)) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise OllamaError(chunk["error"])
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+    except (requests.exceptions.RequestException, ValueError, OllamaError) as e:
+        error = str(e)
+        if isinstance(e, OllamaError):
+            raise
+        raise OllamaError(error) from e
+    finally:
+        _record(payload["model"], wait_s, time.perf_counter() - started, final, error)
+
+
+async def agenerate(prompt, **kwargs):
+    """asyncio version of generate(); runs on a worker thread, so the event
+    loop is never blocked and the global cap still applies."""
+    return await asyncio.to_thread(generate, prompt, **kwargs)
+
+
+async def agenerate_stream(prompt, **kwargs):
+    """asyncio version of generate_stream(): an async iterator of pieces."""
+    loop = asyncio.get_running_loop()
+    pieces = asyncio.Queue()
+    done = object()
+
+    def pump():
+        try:
+            for piece in generate_stream(prompt, **kwargs):
+                loop.call_soon_threadsafe(pieces.put_nowait, piece)
+        except Exception as e:
+            loop.call_soon_threadsafe(pieces.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(pieces.put_nowait, done)
+
+    worker = loop.run_in_executor(None, pump)
+    while (item := await pieces.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    await worker
+
+
+def format_stats():
+    with _stats_lock:
+        n = stats["calls"]
+        if not n:
+            return "no Ollama calls"
+        return (f"{n} Ollama calls ({stats['errors']} failed): avg {stats['total_s'] / n:.2f}s, "
+                f"queued {stats['wait_s'] / n:.2f}s, model loading {stats['load_s']:.1f}s total")
+
+
+def _stub_server():
+    """A local stand-in for Ollama's /api/generate: echoes the prompt after
+    a short delay, streaming word by word when asked."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            cls = type(self)
+            with cls.lock:
+                cls.active += 1
+                cls.peak = max(cls.peak, cls.active)
+            try:
+                time.sleep(0.1)
+                words = f"echo: {body['prompt']}".split(" ")
+                done = {"done": True, "eval_count": len(words), "eval_duration": 100_000_000,
+                        "load_duration": 0, "keep_alive_seen": body.get("keep_alive")}
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson" if body.get("stream") else "application/json")
+                self.end_headers()
+                if body.get("stream"):
+                    for word in words:
+                        self.wfile.write((json.dumps({"response": word + " ", "done": False}) + "\n").encode())
+                        self.wfile.flush()
+                    self.wfile.write((json.dumps(dict(done, response="")) + "\n").encode())
+                else:
+                    self.wfile.write(json.dumps(dict(done, response=" ".join(words))).encode())
+            finally:
+                with cls.lock:
+                    cls.active -= 1
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, StubHandler
+
+
+def selftest():
+    """Run the client against the stub server and check the cap holds."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    server, handler = _stub_server()
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{server.server_port}"
+    print(f"🧪 Stub Ollama on {base_url()}, cap {MAX_CONCURRENCY}")
+
+    assert generate("hello") == "echo: hello"
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        replies = list(pool.map(generate, [f"job {i}" for i in range(8)]))
+    assert replies == [f"echo: job {i}" for i in range(8)]
+    assert handler.peak <= MAX_CONCURRENCY, f"{handler.peak} concurrent requests > cap {MAX_CONCURRENCY}"
+    print(f"✅ 8 parallel calls, at most {handler.peak} at the server at once")
+
+    pieces = list(generate_stream("stream me please"))
+    assert "".join(pieces).strip() == "echo: stream me please" and len(pieces) == 4
+    print(f"✅ streaming: {len(pieces)} pieces")
+
+    async def run_async():
+        replies = await asyncio.gather(*(agenerate(f"async {i}") for i in range(3)))
+        streamed = [piece async for piece in agenerate_stream("async stream")]
+        return replies, streamed
+
+    replies, streamed = asyncio.run(run_async())
+    assert replies == [f"echo: async {i}" for i in range(3)]
+    assert "".join(streamed).strip() == "echo: async stream"
+    print("✅ asyncio: gather + async stream")
+
+    last = calls[-1]
+    print(f"⏱️ {format_stats()}; last call {last['total_ms']:.0f}ms "
+          f"(queued {last['wait_ms']:.0f}ms, {last['eval_tokens']} tokens)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    parser = argparse.ArgumentParser(description="Morpheus Ollama Client")
+    parser.add_argument("prompt", nargs="?", help="Prompt to send")
+    parser.add_argument("--stream", action="store_true", help="Print the reply as it streams")
+    parser.add_argument("--model", help=f"Model (default {MODEL})")
+    parser.add_argument("--selftest", action="store_true", help="Test the client against a local stub server")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+    elif args.prompt:
+        try:
+            if args.stream:
+                for piece in generate_stream(args.prompt, model=args.model):
+                    print(piece, end="", flush=True)
+                print()
+            else:
+                print(generate(args.prompt, model=args.model))
+        except OllamaError as e:
+            print(f"❌ Ollama error: {e}")
+            sys.exit(1)
+        print(f"⏱️ {format_stats()}")
+    else:
+        parser.print_help()
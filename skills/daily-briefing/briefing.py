@@ -15,7 +15,6 @@ import sys
 import os
 import datetime
 import json
-import glob
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -23,6 +22,16 @@ WORKSPACE   = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__
 MISSIONS_DIR = os.path.join(WORKSPACE, "missions")
 NOISE_FILE  = os.path.join(WORKSPACE, "memory", "noise_senders.json")
 
+# Sections run concurrently; whatever isn't back after BRIEFING_DEADLINE
+# seconds is marked as timed out. Mail accounts get a few seconds less so a
+# slow account shows up as "(account X timed out)" rather than the whole
+# email section going missing.
+BRIEFING_DEADLINE = float(os.environ.get("BRIEFING_DEADLINE", 45))
+EMAIL_DEADLINE    = max(1.0, BRIEFING_DEADLINE - 5)
+
+sys.path.insert(0, WORKSPACE)
+from fetch_orchestrator import fetch_all_emails, marker, run_concurrently
+
 DEFAULT_NOISE = [
     "noreply@", "no-reply@", "donotreply@", "newsletter@",
     "marketing@", "notifications@", "updates@", "mailer@",
@@ -41,11 +50,6 @@ def load_json(path, default):
     return default
 
 
-def is_noise(sender: str, noise_list: list) -> bool:
-    s = sender.lower()
-    return any(p.lower() in s for p in DEFAULT_NOISE + noise_list)
-
-
 def get_calendar_events():
     sys.path.insert(0, WORKSPACE)
     from mail_bridge import fetch_upcoming_events
@@ -75,11 +79,12 @@ def get_calendar_events():
 
 def get_recent_emails():
     sys.path.insert(0, WORKSPACE)
-    from mail_bridge import fetch_all_recent_emails
-    noise_list = load_json(NOISE_FILE, [])
+    import mail_bridge
+    from sender_match import SenderMatcher
+    noise = SenderMatcher(DEFAULT_NOISE + load_json(NOISE_FILE, []))
     try:
-        # Fetch up to 10 recent emails from all accounts
-        emails = fetch_all_recent_emails(max_results_per_account=5)
+        # Fetch up to 10 recent emails from all accounts, all at once
+        emails, missing = fetch_all_emails(mail_bridge, 5, deadline=EMAIL_DEADLINE)
         
         # Sort by type and account for cleaner briefing
         emails.sort(key=lambda x: (x['type'], x['account']))
@@ -91,7 +96,7 @@ def get_recent_emails():
             acc_id  = e.get("account", "")
             acc_type = e.get("type", "")
             
-            if is_noise(sender, noise_list):
+            if noise.matches(sender):
                 continue
                 
             sender_short = sender.split("<")[0].strip().strip('"') or sender
@@ -99,7 +104,7 @@ def get_recent_emails():
             
             if len(items) >= 10: # Cap briefing size
                 break
-        return items
+        return items + [f"• {note}" for note in missing]
     except Exception as e:
         return [f"• (email error: {e})"]
 
@@ -107,17 +112,16 @@ def get_recent_emails():
 def get_pending_missions():
     if not os.path.exists(MISSIONS_DIR):
         return []
-    files = glob.glob(os.path.join(MISSIONS_DIR, "*.json"))
+    sys.path.insert(0, WORKSPACE)
+    from mission_store import MissionStore
     items = []
-    for f in files:
-        try:
-            with open(f, encoding="utf-8") as fh:
-                data = json.load(fh)
-            if data.get("status") in ["pending", "notified_cloud"]:
-                task = data.get("task") or data.get("action") or os.path.basename(f)
-                items.append(f"• {task[:70]}")
-        except Exception:
-            pass
+    try:
+        # Index lookup: completed missions are archived and never opened
+        for m in MissionStore(MISSIONS_DIR).pending(("pending", "notified_cloud")):
+            task = m["task"] or m["action"] or m["name"]
+            items.append(f"• {task[:70]}")
+    except Exception as e:
+        return [f"• (missions error: {e})"]
     return items
 
 
@@ -127,8 +131,16 @@ def build_briefing():
 
     lines = [f"🌅 Morning Briefing — {day_str}\n"]
 
+    sections, errors, _ = run_concurrently({
+        "calendar": get_calendar_events,
+        "email": get_recent_emails,
+        "missions": get_pending_missions,
+    }, BRIEFING_DEADLINE)
+    for name, error in errors.items():
+        sections[name] = [f"• {marker(None, name, error)}"]
+
     # Calendar
-    events = get_calendar_events()
+    events = sections["calendar"]
     lines.append("📅 TODAY")
     if events:
         lines.extend(events)
@@ -137,14 +149,14 @@ def build_briefing():
     lines.append("")
 
     # Emails
-    emails = get_recent_emails()
+    emails = sections["email"]
     if emails:
         lines.append("📧 RECENT EMAILS")
         lines.extend(emails)
         lines.append("")
 
     # Pending missions
-    missions = get_pending_missions()
+    missions = sections["missions"]
     if missions:
         lines.append("📋 PENDING MISSIONS")
         lines.extend(missions)
@@ -0,0 +1,261 @@
+"""
+Text chunking for the knowledge base.
+
+Chunkers consume an iterable of text pieces (pages, paragraphs, a single
+string) and yield chunks as soon as they are complete, so a large document
+never has to be held or sliced as one string.
+
+Two strategies (KB_CHUNKER or ingest.py --chunker):
+  tokens  Pack whole sentences up to the embedding model's token budget,
+          with a token overlap between neighbouring chunks (default).
+  chars   Fixed 1000-character windows with 100 characters of overlap. These
+          split words and sentences, and anything past the model's 256
+          tokens is truncated by the encoder and never embedded.
+
+Usage:
+  python chunker.py                   # Compare strategies on everything in kb.db
+  python chunker.py --file book.pdf   # ...or on one file
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+from itertools import islice
+
+import numpy as np
+
+STRATEGY = os.environ.get("KB_CHUNKER", "tokens")
+STRATEGIES = ("tokens", "chars")
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+# all-MiniLM-L6-v2 reads at most 256 tokens, [CLS] and [SEP] included.
+MAX_TOKENS = 256
+TOKEN_OVERLAP = int(os.environ.get("KB_TOKEN_OVERLAP", 32))
+
+# The token chunker tokenizes streamed text this many characters at a time.
+BLOCK_CHARS = 100_000
+
+# Sentence ends: terminal punctuation (plus closing quotes/brackets) followed
+# by whitespace, or a line break.
+SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n\s*')
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+_warned = False
+
+
+def get_tokenizer():
+    """The embedding model's (fast) tokenizer, loaded once per process."""
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            from transformers import AutoTokenizer
+            sys.path.append(os.path.dirname(__file__))
+            import embedder
+            _tokenizer = AutoTokenizer.from_pretrained(f"sentence-transformers/{embedder.MODEL_NAME}")
+    return _tokenizer
+
+
+def iter_char_chunks(pieces, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Fixed-width character windows with overlap.
+
+    Yields exactly what slicing the concatenated text would, while only ever
+    buffering about one chunk plus the current piece.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+    while buffer:
+        yield buffer
+        buffer = buffer[step:]
+
+
+def _sentence_spans(text):
+    spans, start = [], 0
+    for match in SENTENCE_END.finditer(text):
+        if match.end() > start:
+            spans.append((start, match.end()))
+            start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def _split_long(start, offsets, budget):
+    """Cut a sentence longer than the budget into pieces of <= budget tokens,
+    backing each cut up to the start of a word where one is close by.
+
+    Returns ([(tokens, next_piece_start)], tokens_in_last_piece).
+    """
+    cuts, first = [], 0
+    while len(offsets) - first > budget:
+        cut = first + budget
+        while cut > first + budget // 2 and offsets[cut][0] == offsets[cut - 1][1]:
+            cut -= 1
+        if cut == first + budget // 2:
+            cut = first + budget
+        cuts.append((cut - first, start + offsets[cut][0]))
+        first = cut
+    return cuts, len(offsets) - first
+
+
+def _pack(text, tokenizer, budget, overlap, final):
+    """Pack text's sentences into chunks of <= budget tokens.
+
+    Returns (chunks, consumed). Unless final, the last (possibly incomplete)
+    sentence and the last chunk are held back and consumed is where the
+    caller should resume, so the output doesn't depend on block boundaries.
+    """
+    spans = _sentence_spans(text)
+    if not final:
+        spans = spans[:-1]
+    if not spans:
+        return [], 0
+
+    # One batched tokenizer call for the whole block
+    encoded = tokenizer([text[s:e] for s, e in spans], add_special_tokens=False,
+                        return_offsets_mapping=True, verbose=False)
+    starts, lengths = [], []
+    for (s, _), offsets in zip(spans, encoded["offset_mapping"]):
+        cuts, rest = _split_long(s, offsets, budget)
+        position = s
+        for length, cut in cuts:
+            starts.append(position)
+            lengths.append(length)
+            position = cut
+        starts.append(position)
+        lengths.append(rest)
+    starts.append(spans[-1][1])
+
+    # cum[i] = tokens before unit i. A chunk starting at unit i runs to the
+    # last unit ending within cum[i] + budget; the next chunk starts at the
+    # first unit within `overlap` tokens of that end.
+    cum = np.concatenate(([0], np.cumsum(lengths)))
+    n = len(lengths)
+    bounds, i = [], 0
+    while True:
+        end = max(int(np.searchsorted(cum, cum[i] + budget, side="right")) - 1, i + 1)
+        bounds.append((i, end))
+        if end >= n:
+            break
+        i = max(int(np.searchsorted(cum, cum[end] - overlap, side="left")), i + 1)
+
+    consumed = len(text)
+    if not final:
+        consumed = starts[bounds.pop()[0]]
+    chunks = (text[starts[a]:starts[b]].strip() for a, b in bounds)
+    return [c for c in chunks if c], consumed
+
+
+def iter_token_chunks(pieces, max_tokens=MAX_TOKENS, overlap=TOKEN_OVERLAP):
+    """Sentence-packed chunks that fit the model's token budget.
+
+    Pieces are buffered and tokenized in batches of sentences, BLOCK_CHARS
+    at a time; sentences longer than the budget are split on token offsets.
+    """
+    tokenizer = get_tokenizer()
+    budget = max_tokens - tokenizer.num_special_tokens_to_add()
+    buffer, checked = "", 0
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) - checked < BLOCK_CHARS:
+            continue
+        chunks, consumed = _pack(buffer, tokenizer, budget, overlap, final=False)
+        yield from chunks
+        buffer = buffer[consumed:]
+        checked = len(buffer)
+    if buffer.strip():
+        yield from _pack(buffer, tokenizer, budget, overlap, final=True)[0]
+
+
+def iter_chunks(pieces, strategy=None):
+    """Chunk a stream of text pieces with the selected strategy.
+
+    Falls back to character chunks if the tokenizer can't be loaded.
+    """
+    global _warned
+    strategy = strategy or STRATEGY
+    if strategy == "tokens":
+        try:
+            get_tokenizer()
+            return iter_token_chunks(pieces)
+        except (ImportError, OSError) as e:
+            if not _warned:
+                print(f"⚠️ Tokenizer unavailable ({e}); using character chunks.")
+                _warned = True
+    return iter_char_chunks(pieces)
+
+
+def chunk_text(text, strategy=None):
+    """Split text into manageable chunks for embeddings."""
+    return list(iter_chunks([text], strategy))
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def truncation_report(chunks, max_tokens=MAX_TOKENS):
+    """How much of these chunks the encoder actually sees.
+
+    Returns {"chunks", "tokens", "lost", "truncated"}: content tokens, tokens
+    past the model's limit, and the number of chunks that were cut.
+    """
+    tokenizer = get_tokenizer()
+    budget = max_tokens - tokenizer.num_special_tokens_to_add()
+    report = {"chunks": 0, "tokens": 0, "lost": 0, "truncated": 0}
+    for batch in batched(chunks, 256):
+        lengths = np.array([len(ids) for ids in tokenizer(
+            batch, add_special_tokens=False, verbose=False)["input_ids"]])
+        report["chunks"] += len(batch)
+        report["tokens"] += int(lengths.sum())
+        report["lost"] += int(np.maximum(lengths - budget, 0).sum())
+        report["truncated"] += int((lengths > budget).sum())
+    return report
+
+
+def _documents(path=None):
+    if path is None:
+        import db_manager
+        rows = db_manager.get_connection().execute('SELECT raw_text FROM entries')
+        return [text for (text,) in rows if text]
+    if path.endswith(".pdf"):
+        import ingest
+        return ["".join(ingest.iter_pdf_pages(path))]
+    with open(path, "r", encoding="utf-8") as f:
+        return [f.read()]
+
+
+def compare(path=None):
+    """Print chunk counts and truncation loss for each strategy."""
+    documents = _documents(path)
+    print(f"📏 {len(documents)} documents, {MAX_TOKENS}-token model limit\n")
+    print(f"{'chunker':<8} {'chunks':>8} {'tokens':>10} {'lost':>9} {'lost %':>7} {'truncated':>10}")
+    for strategy in STRATEGIES:
+        chunks = (c for doc in documents for c in iter_chunks([doc], strategy))
+        r = truncation_report(chunks)
+        share = 100 * r["lost"] / max(1, r["tokens"])
+        print(f"{strategy:<8} {r['chunks']:>8} {r['tokens']:>10} {r['lost']:>9} "
+              f"{share:>6.1f}% {r['truncated']:>10}")
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description="Morpheus Chunker Comparison")
+    parser.add_argument("--file", help="PDF or text file to chunk (default: every entry in kb.db)")
+    args = parser.parse_args()
+    compare(args.file)
@@ -1,81 +1,378 @@
 import sqlite3
 import os
+import hashlib
+import re
+import threading
+from contextlib import contextmanager
 
 DB_PATH = "/root/.openclaw/library/knowledge/kb.db"
 
+# SQLite caps bound parameters per statement (999 on older builds).
+MAX_PARAMS = 900
+
+_local = threading.local()
+
+
+def get_connection():
+    """Return this thread's shared connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Group writes into one transaction (one commit, one fsync).
+
+    BEGIN IMMEDIATE takes the write lock up front, so ids handed out inside
+    the block are not interleaved with another writer's. Nested use joins the
+    outer transaction.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), MAX_PARAMS):
+        yield ids[start:start + MAX_PARAMS]
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _add_column(conn, table, column, decl):
+    """Add a column to a table created by an older version of this schema."""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {decl}')
+
 
 def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Main sources
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            source_type TEXT,
-            source_url TEXT,
-            title TEXT,
-            raw_text TEXT,
-            summary TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
+    with transaction() as conn:
+        # Main sources
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_type TEXT,
+                source_url TEXT,
+                title TEXT,
+                raw_text TEXT,
+                summary TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT
+            )
+        ''')
+        # Text Chunks for Vector Search
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry_id INTEGER,
+                chunk_text TEXT,
+                chunk_hash TEXT,
+                FOREIGN KEY(entry_id) REFERENCES entries(id)
+            )
+        ''')
+        _add_column(conn, 'entries', 'content_hash', 'TEXT')
+        _add_column(conn, 'chunks', 'chunk_hash', 'TEXT')
+        # SHA-256 of a source file's bytes, so an unchanged file is skipped
+        # before any text is extracted
+        _add_column(conn, 'entries', 'file_hash', 'TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_entry ON chunks(entry_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_source ON entries(source_url)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_hash ON entries(content_hash)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_type_time ON entries(source_type, timestamp)')
+        _init_fts(conn)
+
+
+def _init_fts(conn):
+    """Full-text index over chunk_text, kept in sync with chunks by triggers."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'").fetchone()
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+            USING fts5(chunk_text, content='chunks', content_rowid='id')
+        ''')
+    except sqlite3.OperationalError:
+        return  # SQLite built without FTS5; lexical search stays unavailable
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text)
+            VALUES ('delete', old.id, old.chunk_text);
+        END
     ''')
-    # Text Chunks for Vector Search
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chunks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            entry_id INTEGER,
-            chunk_text TEXT,
-            FOREIGN KEY(entry_id) REFERENCES entries(id)
-        )
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF chunk_text ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, chunk_text)
+            VALUES ('delete', old.id, old.chunk_text);
+            INSERT INTO chunks_fts(rowid, chunk_text) VALUES (new.id, new.chunk_text);
+        END
     ''')
-    conn.commit()
-    conn.close()
+    if not exists:
+        # Index chunks written before the FTS table existed
+        conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+
+
+def add_entry(source_type, source_url, title, raw_text, summary="", digest=None):
+    with transaction() as conn:
+        cursor = conn.execute('''
+            INSERT INTO entries (source_type, source_url, title, raw_text, summary, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (source_type, source_url, title, raw_text, summary,
+              digest or content_hash(raw_text)))
+        return cursor.lastrowid
+
+
+def update_entry(entry_id, title, raw_text, digest=None):
+    """Replace an entry's text after its source changed."""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE entries SET title = ?, raw_text = ?, content_hash = ?,
+                               timestamp = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (title, raw_text, digest or content_hash(raw_text), entry_id))
+
 
+def set_file_hash(entry_id, file_hash, source_url=None):
+    """Record the hash of the file an entry was read from. With source_url,
+    only if the entry came from that file (not an identical copy elsewhere)."""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE entries SET file_hash = ?
+            WHERE id = ? AND (? IS NULL OR source_url = ?)
+        ''', (file_hash, entry_id, source_url, source_url))
 
-def add_entry(source_type, source_url, title, raw_text, summary=""):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO entries (source_type, source_url, title, raw_text, summary)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (source_type, source_url, title, raw_text, summary))
-    entry_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return entry_id
+
+def find_file(source_url, file_hash):
+    """The id of the entry ingested from this exact file, or None."""
+    row = get_connection().execute('''
+        SELECT id FROM entries WHERE source_url = ? AND file_hash = ?
+        ORDER BY id DESC LIMIT 1
+    ''', (source_url, file_hash)).fetchone()
+    return row[0] if row else None
+
+
+def find_entry(source_url, digest):
+    """Find a previous ingest of this source or of identical content.
+
+    Returns (entry_id, content_hash), preferring an exact content match, or
+    None if neither the URL nor the content has been seen.
+    """
+    conn = get_connection()
+    return conn.execute('''
+        SELECT id, content_hash FROM entries
+        WHERE content_hash = ? OR source_url = ?
+        ORDER BY content_hash = ? DESC, id DESC
+        LIMIT 1
+    ''', (digest, source_url, digest)).fetchone()
 
 
 def add_chunk(entry_id, chunk_text):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO chunks (entry_id, chunk_text)
-        VALUES (?, ?)
-    ''', (entry_id, chunk_text))
-    chunk_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return chunk_id
+    return add_chunks(entry_id, [chunk_text])[0]
+
+
+def add_chunks(entry_id, chunk_texts, chunk_hashes=None):
+    """Insert many chunks in one transaction. Returns their ids in order."""
+    chunk_texts = list(chunk_texts)
+    if not chunk_texts:
+        return []
+    chunk_hashes = chunk_hashes or [content_hash(text) for text in chunk_texts]
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO chunks (entry_id, chunk_text, chunk_hash)
+            VALUES (?, ?, ?)
+        ''', ((entry_id, text, digest) for text, digest in zip(chunk_texts, chunk_hashes)))
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    # We held the write lock for the whole insert, so the ids are contiguous
+    return list(range(last_id - len(chunk_texts) + 1, last_id + 1))
+
+
+def get_chunk_hashes(entry_id):
+    """Return [(chunk_id, chunk_hash)] for an entry, hashing legacy rows on the fly."""
+    conn = get_connection()
+    rows = conn.execute('SELECT id, chunk_hash, chunk_text FROM chunks WHERE entry_id = ?',
+                        (entry_id,))
+    return [(cid, digest or content_hash(text)) for cid, digest, text in rows]
+
+
+def delete_chunks(chunk_ids):
+    with transaction() as conn:
+        for batch in _batches(chunk_ids):
+            placeholders = ','.join('?' * len(batch))
+            conn.execute(f'DELETE FROM chunks WHERE id IN ({placeholders})', batch)
 
 
 def get_chunk(chunk_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT chunk_text, entry_id FROM chunks WHERE id = ?',
-                   (chunk_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row
+    return get_chunks([chunk_id]).get(chunk_id)
+
+
+def get_chunks(chunk_ids):
+    """Return {chunk_id: (chunk_text, entry_id)} for the ids that exist."""
+    conn = get_connection()
+    found = {}
+    for batch in _batches(chunk_ids):
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(
+                f'SELECT id, chunk_text, entry_id FROM chunks WHERE id IN ({placeholders})',
+                batch):
+            found[row[0]] = (row[1], row[2])
+    return found
 
 
 def get_entry(entry_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM entries WHERE id = ?', (entry_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row
+    return get_entries([entry_id]).get(entry_id)
+
+
+def get_entries(entry_ids):
+    """Return {entry_id: row} for the ids that exist."""
+    conn = get_connection()
+    found = {}
+    for batch in _batches(entry_ids):
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(
+                f'SELECT * FROM entries WHERE id IN ({placeholders})', batch):
+            found[row[0]] = row
+    return found
+
+
+def get_search_rows(chunk_ids):
+    """Hydrate search hits in one query.
+
+    Returns {chunk_id: (chunk_text, entry_id, source_type, source_url, title,
+    snippet)} where snippet is the first 200 characters of the entry text.
+    """
+    conn = get_connection()
+    found = {}
+    for batch in _batches(chunk_ids):
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(f'''
+                SELECT c.id, c.chunk_text, e.id, e.source_type, e.source_url,
+                       e.title, substr(e.raw_text, 1, 200)
+                FROM chunks c JOIN entries e ON e.id = c.entry_id
+                WHERE c.id IN ({placeholders})
+                ''', batch):
+            found[row[0]] = row[1:]
+    return found
+
+
+def _fts_query(query):
+    """Turn free text into an FTS5 query: every word quoted, any may match.
+
+    Quoting keeps tickers, paths and error strings from being parsed as
+    FTS5 syntax; BM25 still ranks chunks matching more of the words first.
+    """
+    words = re.findall(r"\w+", query)
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+def _entry_filter(source_type=None, since=None, entry_id=None):
+    """WHERE conditions on entries (aliased e) and their parameters."""
+    conditions, params = [], []
+    if source_type:
+        conditions.append('e.source_type = ?')
+        params.append(source_type)
+    if since:
+        conditions.append('e.timestamp >= ?')
+        params.append(since)
+    if entry_id is not None:
+        conditions.append('e.id = ?')
+        params.append(entry_id)
+    return conditions, params
+
+
+def filter_chunk_ids(source_type=None, since=None, entry_id=None):
+    """Ids of the chunks whose entry matches every given filter.
+
+    since is a 'YYYY-MM-DD HH:MM:SS' UTC timestamp (entries.timestamp).
+    """
+    conditions, params = _entry_filter(source_type, since, entry_id)
+    rows = get_connection().execute(f'''
+        SELECT c.id FROM chunks c JOIN entries e ON e.id = c.entry_id
+        WHERE {' AND '.join(conditions) or '1'}
+    ''', params)
+    return [row[0] for row in rows]
+
+
+def lexical_search(query, limit=10, source_type=None, since=None, entry_id=None):
+    """BM25 full-text search over chunks, optionally restricted to entries
+    matching the filters. Returns [(chunk_id, score)], best first."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    conditions, params = _entry_filter(source_type, since, entry_id)
+    if conditions:
+        sql = f'''
+            SELECT chunks_fts.rowid, bm25(chunks_fts) FROM chunks_fts
+            JOIN chunks c ON c.id = chunks_fts.rowid JOIN entries e ON e.id = c.entry_id
+            WHERE chunks_fts MATCH ? AND {' AND '.join(conditions)}
+            ORDER BY rank LIMIT ?
+        '''
+    else:
+        sql = 'SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?'
+    args = [match] + params + [limit]
+    try:
+        return get_connection().execute(sql, args).fetchall()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        init_db()  # database from before the FTS index existed
+        return get_connection().execute(sql, args).fetchall()
+
+
+def get_chunk_texts(chunk_ids):
+    """Return [(chunk_id, chunk_text, chunk_hash)] for the ids that exist."""
+    conn = get_connection()
+    found = []
+    for batch in _batches(chunk_ids):
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(
+            f'SELECT id, chunk_text, chunk_hash FROM chunks WHERE id IN ({placeholders})', batch)
+        found.extend((cid, text, digest or content_hash(text)) for cid, text, digest in rows)
+    return found
+
+
+def get_all_chunks():
+    """Return every (chunk_id, chunk_text, chunk_hash) in id order."""
+    conn = get_connection()
+    rows = conn.execute('SELECT id, chunk_text, chunk_hash FROM chunks ORDER BY id')
+    return [(cid, text, digest or content_hash(text)) for cid, text, digest in rows]
+
+
+def count_chunks():
+    return get_connection().execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+
+def delete_entry(entry_id):
+    """Delete an entry and its chunks. Returns the deleted chunk ids."""
+    with transaction() as conn:
+        chunk_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM chunks WHERE entry_id = ?', (entry_id,))]
+        conn.execute('DELETE FROM chunks WHERE entry_id = ?', (entry_id,))
+        conn.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+    return chunk_ids
 
 
 if __name__ == "__main__":
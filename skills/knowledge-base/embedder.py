@@ -0,0 +1,292 @@
+"""
+Embedding Service - Morpheus AI
+Skill: knowledge-base
+
+Keeps the SentenceTransformer model warm in a long-lived localhost daemon so
+ingest.py and search.py don't pay several seconds of model loading per call.
+Concurrent requests are micro-batched into a single model.encode() call.
+
+Callers just use encode(); it talks to the daemon when it is up and falls
+back to loading the model in-process when it isn't.
+
+Usage:
+  python embedder.py --serve            # Run the daemon
+  python embedder.py --serve --rerank   # ...with the re-ranking cross-encoder warm too
+  python embedder.py --ping             # Check whether the daemon is up
+"""
+
+import argparse
+import base64
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBED_URL = os.environ.get("KB_EMBED_URL", "http://127.0.0.1:8765")
+
+# Micro-batching: wait this long after the first request for others to join,
+# but never put more than MAX_BATCH texts through one encode() call.
+BATCH_WINDOW = 0.005
+MAX_BATCH = 256
+
+# A stopped daemon refuses the connection immediately; this only bounds a hung one.
+CONNECT_TIMEOUT = 1.0
+
+_local_model = None
+_local_lock = threading.Lock()
+_daemon_down = False
+
+
+def _load_model():
+    """Load the SentenceTransformer once per process."""
+    global _local_model
+    with _local_lock:
+        if _local_model is None:
+            from sentence_transformers import SentenceTransformer
+            _local_model = SentenceTransformer(MODEL_NAME)
+    return _local_model
+
+
+def _pack(vectors):
+    return base64.b64encode(np.ascontiguousarray(vectors, dtype='float32').tobytes()).decode("ascii")
+
+
+def _unpack(payload, dim):
+    data = np.frombuffer(base64.b64decode(payload), dtype='float32')
+    return data.reshape(-1, dim)
+
+
+def _encode_remote(texts):
+    """Encode via the daemon. Returns None if it is unreachable."""
+    global _daemon_down
+    if _daemon_down:
+        return None
+    try:
+        resp = requests.post(f"{EMBED_URL}/encode", json={
+            "model": MODEL_NAME,
+            "texts": texts
+        }, timeout=(CONNECT_TIMEOUT, 60 + len(texts) // 10))
+        if resp.status_code != 200:
+            print(f"[embedder] daemon refused request: {resp.text}", file=sys.stderr)
+            _daemon_down = True
+            return None
+        body = resp.json()
+        return _unpack(body["vectors"], body["dim"])
+    except requests.exceptions.RequestException:
+        _daemon_down = True
+        return None
+
+
+def encode(texts):
+    """Embed a list of strings. Returns a float32 array of shape (n, dim)."""
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+
+    vectors = _encode_remote(texts)
+    if vectors is not None:
+        return vectors
+
+    model = _load_model()
+    return np.asarray(model.encode(texts), dtype='float32')
+
+
+def encode_cached(texts, hashes=None):
+    """Like encode(), but reuses vectors from the on-disk embedding cache and
+    only embeds (and then caches) texts it hasn't seen with this model."""
+    import db_manager
+    import embedding_cache
+
+    texts = list(texts)
+    if not texts:
+        return np.zeros((0, 0), dtype='float32')
+    hashes = list(hashes) if hashes is not None else [db_manager.content_hash(t) for t in texts]
+
+    cached = embedding_cache.get_many(MODEL_NAME, hashes)
+    missing = {}
+    for text, digest in zip(texts, hashes):
+        if digest not in cached:
+            missing.setdefault(digest, text)
+    embedding_cache.stats["hits"] += len(texts) - sum(1 for d in hashes if d not in cached)
+    embedding_cache.stats["misses"] += len(missing)
+
+    if missing:
+        fresh = encode(list(missing.values()))
+        embedding_cache.put_many(MODEL_NAME, list(missing), fresh)
+        cached.update(zip(missing, fresh))
+    return np.vstack([cached[digest] for digest in hashes])
+
+
+# --- Daemon ---
+
+class Batcher:
+    """Collects encode requests from handler threads into shared batches."""
+
+    def __init__(self, model):
+        self.model = model
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts):
+        future = Future()
+        self.requests.put((texts, future))
+        return future
+
+    def _collect(self):
+        pending = [self.requests.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + BATCH_WINDOW
+        while size < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            texts = [t for batch, _ in pending for t in batch]
+            try:
+                vectors = np.asarray(self.model.encode(texts), dtype='float32')
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for batch, future in pending:
+                future.set_result(vectors[offset:offset + len(batch)])
+                offset += len(batch)
+
+
+class EmbedServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class EmbedHandler(BaseHTTPRequestHandler):
+    batcher = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._reply(404, {"error": "not found"})
+            return
+        self._reply(200, {
+            "model": MODEL_NAME,
+            "dim": self.batcher.model.get_sentence_embedding_dimension(),
+            "batches": self.batcher.batches,
+            "texts": self.batcher.texts
+        })
+
+    def do_POST(self):
+        if self.path not in ("/encode", "/rerank"):
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+        except (ValueError, json.JSONDecodeError):
+            self._reply(400, {"error": "invalid JSON body"})
+            return
+
+        if self.path == "/rerank":
+            self._rerank(body)
+            return
+
+        if body.get("model", MODEL_NAME) != MODEL_NAME:
+            self._reply(409, {"error": f"daemon serves {MODEL_NAME}, not {body.get('model')}"})
+            return
+
+        texts = body.get("texts") or []
+        try:
+            vectors = self.batcher.submit(texts).result()
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+            return
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        self._reply(200, {"dim": dim, "vectors": _pack(vectors)})
+
+    def _rerank(self, body):
+        import reranker
+
+        if body.get("model", reranker.RERANK_MODEL) != reranker.RERANK_MODEL:
+            self._reply(409, {"error": f"daemon serves {reranker.RERANK_MODEL}, not {body.get('model')}"})
+            return
+        try:
+            scores = reranker.predict(body.get("query", ""), body.get("texts") or [])
+        except Exception as e:
+            self._reply(500, {"error": str(e)})
+            return
+        self._reply(200, {"scores": scores.tolist()})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(rerank=False):
+    """Run the embedding daemon until interrupted."""
+    url = urlparse(EMBED_URL)
+    print(f"🧠 Loading {MODEL_NAME}...")
+    EmbedHandler.batcher = Batcher(_load_model())
+    if rerank:
+        import reranker
+        print(f"🧠 Loading {reranker.RERANK_MODEL}...")
+        reranker.load_model()
+    server = EmbedServer((url.hostname, url.port), EmbedHandler)
+    print(f"✅ Embedding daemon listening on {EMBED_URL}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def ping():
+    try:
+        resp = requests.get(f"{EMBED_URL}/health", timeout=2)
+        info = resp.json()
+        print(f"✅ Daemon up at {EMBED_URL}: {info['model']} (dim {info['dim']}), "
+              f"{info['texts']} texts in {info['batches']} batches")
+    except requests.exceptions.RequestException:
+        print(f"❌ No embedding daemon at {EMBED_URL} (clients load the model in-process)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Morpheus Embedding Service")
+    parser.add_argument("--serve", action="store_true", help="Run the embedding daemon")
+    parser.add_argument("--rerank", action="store_true", help="Also load the re-ranking cross-encoder up front")
+    parser.add_argument("--ping", action="store_true", help="Check whether the daemon is up")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.rerank)
+    else:
+        ping()
@@ -0,0 +1,80 @@
+"""
+Embedding cache for the knowledge base.
+
+Stores float32 embeddings in SQLite keyed by (model name, chunk hash), so
+re-ingests, index rebuilds and engine changes don't pay for embedding the
+same text twice. Lives next to kb.db in its own file; deleting it is safe.
+"""
+
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+CACHE_PATH = "/root/.openclaw/library/knowledge/embeddings.db"
+
+MAX_PARAMS = 900
+
+_local = threading.local()
+
+stats = {"hits": 0, "misses": 0}
+
+
+def get_connection():
+    """Return this thread's cache connection, creating the table on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != CACHE_PATH:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                chunk_hash TEXT,
+                vector BLOB,
+                PRIMARY KEY (model, chunk_hash)
+            ) WITHOUT ROWID
+        ''')
+        _local.conn = conn
+        _local.path = CACHE_PATH
+    return conn
+
+
+def get_many(model, hashes):
+    """Return {chunk_hash: vector} for the hashes already cached."""
+    conn = get_connection()
+    hashes = list(dict.fromkeys(hashes))
+    found = {}
+    for start in range(0, len(hashes), MAX_PARAMS):
+        batch = hashes[start:start + MAX_PARAMS]
+        placeholders = ','.join('?' * len(batch))
+        for digest, blob in conn.execute(
+                f'SELECT chunk_hash, vector FROM embeddings '
+                f'WHERE model = ? AND chunk_hash IN ({placeholders})',
+                [model] + batch):
+            found[digest] = np.frombuffer(blob, dtype='float32')
+    return found
+
+
+def put_many(model, hashes, vectors):
+    """Cache vectors (one row per hash) in a single transaction."""
+    vectors = np.asarray(vectors, dtype='float32')
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(
+            'INSERT OR REPLACE INTO embeddings (model, chunk_hash, vector) VALUES (?, ?, ?)',
+            ((model, digest, vector.tobytes()) for digest, vector in zip(hashes, vectors)))
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def count(model=None):
+    conn = get_connection()
+    if model is None:
+        return conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+    return conn.execute('SELECT COUNT(*) FROM embeddings WHERE model = ?', (model,)).fetchone()[0]
@@ -0,0 +1,299 @@
+"""
+Vector Index Maintenance - Morpheus AI
+Skill: knowledge-base
+
+Usage:
+  python index_tool.py rebuild               # Re-embed all chunks into a fresh id-keyed index
+  python index_tool.py rebuild --engine hnsw # ...pinning an engine (flat, hnsw, ivfpq, auto)
+  python index_tool.py delete --entry 42     # Remove an entry and its vectors
+  python index_tool.py stats                 # Show index and database counts
+  python index_tool.py compact               # Fold delta segments and deletes into the base index
+  python index_tool.py bench                 # Recall vs latency vs memory for each engine
+  python index_tool.py convert --storage sq8 # Re-encode the base as float16/SQ8/PQ (size, RSS, recall)
+
+`rebuild` is also the migration path for indexes written before vectors were
+keyed by chunk id: it re-embeds every row in `chunks` from SQLite (the source
+of truth) and keeps the old file as vector.index.bak.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import faiss
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+sys.path.append(os.path.dirname(__file__))
+import db_manager
+import embedder
+import embedding_cache
+import search
+import vector_store
+
+REBUILD_BATCH = 256
+
+
+def embed_all_chunks():
+    """Re-embed every chunk in the database, reusing cached embeddings.
+    Returns (ids, vectors)."""
+    rows = db_manager.get_all_chunks()
+    if not rows:
+        return np.zeros(0, dtype='int64'), None
+
+    print(f"🧠 Re-embedding {len(rows)} chunks...")
+    hits_before = embedding_cache.stats["hits"]
+    parts = []
+    for start in range(0, len(rows), REBUILD_BATCH):
+        batch = rows[start:start + REBUILD_BATCH]
+        parts.append(embedder.encode_cached([text for _, text, _ in batch],
+                                            [digest for _, _, digest in batch]))
+        print(f"  {min(start + REBUILD_BATCH, len(rows))}/{len(rows)}")
+    print(f"♻️ {embedding_cache.stats['hits'] - hits_before}/{len(rows)} embeddings from cache")
+    return np.array([cid for cid, _, _ in rows], dtype='int64'), np.vstack(parts)
+
+
+def _install(index, meta, snap):
+    if os.path.exists(vector_store.INDEX_PATH):
+        backup = f"{vector_store.INDEX_PATH}.bak"
+        shutil.copy2(vector_store.INDEX_PATH, backup)
+        print(f"📦 Previous index kept at {backup}")
+    vector_store.replace_base(index, meta, snap)
+
+
+def rebuild(engine=None, storage=None):
+    snap = vector_store.snapshot()
+    ids, vectors = embed_all_chunks()
+    if vectors is None:
+        print("No chunks in the database; nothing to index.")
+        return
+
+    storage = storage or vector_store.read_meta().get("storage")
+    try:
+        index, meta = vector_store.build_index(ids, vectors, engine=engine, pinned=bool(engine),
+                                               storage=storage)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    _install(index, meta, snap)
+    print(f"✅ Rebuilt {vector_store.INDEX_PATH} with {index.ntotal} vectors "
+          f"({meta['engine']}, {meta['storage']})")
+
+
+def delete(entry_id):
+    chunk_ids = db_manager.delete_entry(entry_id)
+    if not chunk_ids:
+        print(f"No chunks found for entry {entry_id}.")
+        return
+    vector_store.remove(chunk_ids)
+    print(f"🗑️ Deleted entry {entry_id}: {len(chunk_ids)} chunks (vectors dropped at next compaction)")
+
+
+def compact():
+    try:
+        if vector_store.compact(reembed=embed_all_chunks):
+            print(f"✅ Compacted index: {vector_store.count()} vectors ({vector_store.read_meta()['engine']})")
+        else:
+            print("Nothing to compact (or a compaction is already running).")
+    except vector_store.LegacyIndexError as e:
+        print(f"⚠️ {e}")
+
+
+def stats():
+    chunks = db_manager.count_chunks()
+    try:
+        parts, deleted = vector_store.load_parts()
+    except vector_store.LegacyIndexError as e:
+        print(f"⚠️ {e}")
+        return
+    if not parts:
+        print(f"📊 Chunks in DB: {chunks} | No index yet")
+        return
+
+    meta = vector_store.read_meta()
+    vectors = vector_store.count()
+    memory_mb = sum(vector_store.memory_bytes(p) for p in parts) / 1e6
+    segments = len(parts) - (1 if os.path.exists(vector_store.INDEX_PATH) else 0)
+    print(f"📊 Chunks in DB: {chunks} | Vectors in index: {vectors}")
+    print(f"⚙️ Engine: {meta.get('engine')} ({meta.get('storage', 'f32')}) | Delta segments: {segments} | "
+          f"Pending deletes: {len(deleted)} | Memory: {memory_mb:.1f} MB")
+    print(f"♻️ Cached embeddings ({embedder.MODEL_NAME}): {embedding_cache.count(embedder.MODEL_NAME)}")
+    if chunks != vectors:
+        print("⚠️ Counts differ; run 'python index_tool.py rebuild' to resync.")
+    if vector_store.needs_rebuild(vectors, meta):
+        print(f"⚠️ Corpus size calls for '{vector_store.choose_engine(vectors, meta)}' "
+              "or a retrain; run 'python index_tool.py compact'.")
+
+
+def _timed_search(index, queries, k):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return (time.perf_counter() - start) * 1000 / len(queries), ids
+
+
+def _recall(found, truth):
+    hits = sum(len(set(f[f != -1]) & set(t[t != -1])) for f, t in zip(found, truth))
+    return hits / max(1, (truth != -1).sum())
+
+
+def bench(k=10, queries=200):
+    """Compare approximate engines against the flat baseline on the real corpus."""
+    stored = vector_store.stored_vectors()
+    ids, vectors = stored if stored is not None else embed_all_chunks()
+    if vectors is None or len(vectors) == 0:
+        print("No vectors to benchmark.")
+        return
+
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    print(f"📏 {len(vectors)} vectors, {len(sample)} queries, recall@{k} vs flat\n")
+    print(f"{'engine':<8} {'param':<14} {'recall':>7} {'ms/query':>9} {'memory MB':>10}")
+
+    def report(name, param, candidate, truth=None):
+        ms, found = _timed_search(candidate, sample, k)
+        recall = 1.0 if truth is None else _recall(found, truth)
+        mb = vector_store.memory_bytes(candidate) / 1e6
+        print(f"{name:<8} {param:<14} {recall:>7.3f} {ms:>9.3f} {mb:>10.1f}")
+        return found
+
+    baseline, _ = vector_store.build_index(ids, vectors, engine="flat")
+    truth = report("flat", "exact", baseline)
+
+    hnsw, _ = vector_store.build_index(ids, vectors, engine="hnsw")
+    for ef in (16, 32, 64, 128, 256):
+        vector_store.tune(hnsw, ef_search=ef)
+        report("hnsw", f"efSearch={ef}", hnsw, truth)
+
+    if len(vectors) < vector_store.IVFPQ_MIN_TRAIN:
+        print(f"ivfpq    (skipped: needs >= {vector_store.IVFPQ_MIN_TRAIN} vectors to train)")
+        return
+    ivfpq, _ = vector_store.build_index(ids, vectors, engine="ivfpq")
+    for nprobe in (4, 8, 16, 32, 64):
+        vector_store.tune(ivfpq, nprobe=nprobe)
+        report("ivfpq", f"nprobe={nprobe}", ivfpq, truth)
+
+
+def _rss_bytes():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _measure(path, k, sample, truth, ids, vectors, meta):
+    """Disk size, RSS growth on load, and recall@k (raw and re-ranked)."""
+    rss_before = _rss_bytes()
+    index = vector_store.tune(faiss.read_index(path))
+    rss_after = _rss_bytes()
+    rss_mb = (rss_after - rss_before) / 1e6 if rss_before is not None else None
+
+    _, found = index.search(sample, k)
+    recall = _recall(found, truth)
+    reranked = None
+    if vector_store.is_lossy(meta):
+        _, candidates = index.search(sample, k * search.RERANK_FACTOR)
+        order = np.argsort(ids)
+        found = []
+        for query, row in zip(sample, candidates):
+            row = row[row != -1]
+            exact = vectors[order[np.searchsorted(ids, row, sorter=order)]]
+            distances = ((exact - query) ** 2).sum(axis=1)
+            found.append(np.pad(row[distances.argsort()[:k]], (0, k), constant_values=-1)[:k])
+        reranked = _recall(np.array(found), truth)
+    return os.path.getsize(path) / 1e6, rss_mb, recall, reranked
+
+
+def convert(storage, engine=None, k=10, queries=200, apply=True):
+    """Re-encode the base index with another storage, reporting size, RSS
+    and recall@k (against exact float32 search) before and after."""
+    snap = vector_store.snapshot()
+    ids, vectors = embed_all_chunks()
+    if vectors is None:
+        print("No chunks in the database; nothing to index.")
+        return
+    meta = vector_store.read_meta()
+    engine = engine or meta.get("engine") or vector_store.choose_engine(len(ids))
+    try:
+        index, new_meta = vector_store.build_index(ids, vectors, engine=engine,
+                                                   pinned=meta.get("pinned", False), storage=storage)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    # Ground truth: exact search over the float32 vectors
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(queries, len(vectors)), replace=False)]
+    baseline, _ = vector_store.build_index(ids, vectors, engine="flat", storage="f32")
+    _, truth = baseline.search(sample, k)
+
+    tmp_path = f"{vector_store.INDEX_PATH}.convert"
+    faiss.write_index(index, tmp_path)
+    rows = []
+    if os.path.exists(vector_store.INDEX_PATH):
+        rows.append((f"{meta.get('engine')}/{meta.get('storage', 'f32')} (now)",
+                     _measure(vector_store.INDEX_PATH, k, sample, truth, ids, vectors, meta)))
+    rows.append((f"{engine}/{storage}",
+                 _measure(tmp_path, k, sample, truth, ids, vectors, new_meta)))
+    os.remove(tmp_path)
+
+    print(f"📏 {len(ids)} vectors, {len(sample)} queries, recall@{k} vs exact float32\n")
+    print(f"{'index':<18} {'disk MB':>8} {'RSS MB':>7} {'recall':>7} {'reranked':>9}")
+    for name, (disk_mb, rss_mb, recall, reranked) in rows:
+        rss = f"{rss_mb:.1f}" if rss_mb is not None else "n/a"
+        rerank = f"{reranked:.3f}" if reranked is not None else "-"
+        print(f"{name:<18} {disk_mb:>8.1f} {rss:>7} {recall:>7.3f} {rerank:>9}")
+
+    if not apply:
+        print("\n(dry run: index left unchanged)")
+        return
+    _install(index, new_meta, snap)
+    print(f"\n✅ Converted {vector_store.INDEX_PATH} to {engine}/{storage}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Morpheus Vector Index Maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="Re-embed all chunks into a fresh id-keyed index")
+    rebuild_parser.add_argument("--engine", choices=vector_store.ENGINES + ("auto",),
+                                help="Pin an engine instead of picking by corpus size ('auto' unpins)")
+    rebuild_parser.add_argument("--storage", choices=vector_store.STORAGES,
+                                help="Vector encoding for the base (default: keep the current one)")
+    delete_parser = sub.add_parser("delete", help="Remove an entry and its vectors")
+    delete_parser.add_argument("--entry", type=int, required=True, help="Entry ID to delete")
+    sub.add_parser("stats", help="Show index and database counts")
+    sub.add_parser("compact", help="Fold delta segments and deletes into the base index")
+    bench_parser = sub.add_parser("bench", help="Recall vs latency vs memory for each engine")
+    bench_parser.add_argument("--k", type=int, default=10, help="Neighbours per query")
+    bench_parser.add_argument("--queries", type=int, default=200, help="Sampled queries")
+    convert_parser = sub.add_parser("convert", help="Re-encode the base as float16/SQ8/PQ")
+    convert_parser.add_argument("--storage", choices=vector_store.STORAGES, required=True,
+                                help="f32, fp16, sq8 (scalar quantised) or pq (product quantised)")
+    convert_parser.add_argument("--engine", choices=vector_store.ENGINES, help="Engine (default: current)")
+    convert_parser.add_argument("--k", type=int, default=10, help="Neighbours per query")
+    convert_parser.add_argument("--queries", type=int, default=200, help="Sampled queries")
+    convert_parser.add_argument("--dry-run", action="store_true", help="Only report; keep the current index")
+    args = parser.parse_args()
+
+    db_manager.init_db()
+    if args.command == "rebuild":
+        rebuild(None if args.engine == "auto" else args.engine, args.storage)
+    elif args.command == "delete":
+        delete(args.entry)
+    elif args.command == "compact":
+        compact()
+    elif args.command == "bench":
+        bench(args.k, args.queries)
+    elif args.command == "convert":
+        convert(args.storage, args.engine, args.k, args.queries, apply=not args.dry_run)
+    else:
+        stats()
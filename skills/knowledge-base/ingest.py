@@ -1,20 +1,41 @@
 import argparse
+import hashlib
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
 import requests
 from bs4 import BeautifulSoup
 from youtube_transcript_api import YouTubeTranscriptApi
 from pypdf import PdfReader
-from sentence_transformers import SentenceTransformer
-import faiss
 
 # Import local DB manager
 sys.path.append(os.path.dirname(__file__))
+import chunker
 import db_manager
+import embedder
+import vector_store
 
-INDEX_PATH = "/root/.openclaw/library/knowledge/vector.index"
-MODEL_NAME = 'all-MiniLM-L6-v2'
+FETCH_WORKERS = 8
+EMBED_BATCH = 512
+MIN_TEXT_LENGTH = 50
+INGESTABLE_EXTENSIONS = (".pdf", ".txt")
+
+# PDFs at least this long are extracted on a process pool, PDF_PAGE_BATCH
+# pages per task, with at most two tasks in flight per worker.
+PARALLEL_PDF_PAGES = 64
+PDF_PAGE_BATCH = 16
+
+# In batch mode, PDFs this big are streamed one at a time; smaller ones are
+# extracted on the fetch pool and stored with the rest of the batch.
+STREAM_PDF_BYTES = 20 * 1024 * 1024
+
+# The fetchers report failures as text; these prefixes mark such results
+FETCH_ERRORS = (
+    "Invalid YouTube URL", "Could not fetch transcript",
+    "Error fetching article", "Error reading PDF",
+)
 
 
 def get_youtube_id(url):
@@ -61,52 +82,378 @@ def fetch_web_article(url):
         return f"Error fetching article: {e}"
 
 
+def _extract_pages(file_path, start, stop):
+    """Extract text from pages [start, stop) of a PDF (process pool worker)."""
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def iter_pdf_pages(file_path, workers=None):
+    """Yield the text of each PDF page in order.
+
+    Long PDFs are extracted across `workers` processes (default: CPU count),
+    with a bounded number of page batches in flight so memory stays flat.
+    """
+    reader = PdfReader(file_path)
+    page_count = len(reader.pages)
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or page_count < PARALLEL_PDF_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    ranges = [(start, min(start + PDF_PAGE_BATCH, page_count))
+              for start in range(0, page_count, PDF_PAGE_BATCH)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for start, stop in ranges:
+            pending.append(pool.submit(_extract_pages, file_path, start, stop))
+            if len(pending) >= 2 * workers:
+                yield from pending.pop(0).result()
+        for future in pending:
+            yield from future.result()
+
+
+def file_digest(file_path, block_size=1 << 20):
+    """SHA-256 of a file's bytes, read a block at a time."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def fetch_pdf_text(file_path):
     """Extract text from PDF."""
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-        return text
+        return "".join(iter_pdf_pages(file_path))
     except Exception as e:
         return f"Error reading PDF: {e}"
 
 
-def chunk_text(text, chunk_size=1000, overlap=100):
+def chunk_text(text):
     """Split text into manageable chunks for embeddings."""
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += (chunk_size - overlap)
-    return chunks
+    return chunker.chunk_text(text)
 
 
-def update_vector_index(entry_id, raw_text):
-    """Embed chunks and update FAISS index."""
-    model = SentenceTransformer(MODEL_NAME)
-    chunks = chunk_text(raw_text)
+def _chunk_hashes_by_digest(entry_id):
+    existing = {}
+    if entry_id is not None:
+        for chunk_id, digest in db_manager.get_chunk_hashes(entry_id):
+            existing.setdefault(digest, []).append(chunk_id)
+    return existing
+
+
+def _take_new(chunks, existing):
+    """Return [(chunk, hash)] not already in `existing`, consuming matches."""
+    new = []
+    for chunk in chunks:
+        digest = db_manager.content_hash(chunk)
+        if existing.get(digest):
+            existing[digest].pop()
+        else:
+            new.append((chunk, digest))
+    return new
 
-    if not chunks:
-        return
 
-    embeddings = model.encode(chunks)
-    dimension = embeddings.shape[1]
+def diff_chunks(entry_id, chunks):
+    """Split a document's chunks into ones that need embedding and stale ids.
 
-    if os.path.exists(INDEX_PATH):
-        index = faiss.read_index(INDEX_PATH)
+    Chunks whose hash already exists under entry_id are kept as they are
+    (row and vector), so re-ingest cost scales with what changed.
+    Returns ([(chunk, hash)] to add, [chunk_id] to drop).
+    """
+    existing = _chunk_hashes_by_digest(entry_id)
+    new = _take_new(chunks, existing)
+    stale = [chunk_id for ids in existing.values() for chunk_id in ids]
+    return new, stale
+
+
+def store_documents(docs, compact=True):
+    """Store fetched documents and update the FAISS index.
+
+    docs is [(source_url, source_type, title, raw_text)]. A source whose
+    content hash is unchanged (or whose content is already stored under
+    another URL) is a no-op; a changed source only embeds chunks that differ.
+    Returns one dict per doc with entry_id, status (new, updated, unchanged),
+    and counts of embedded, kept and removed chunks. With compact=False a
+    due compaction is left to the caller.
+    """
+    results = []
+    seen = {}
+    for source_url, _, _, raw_text in docs:
+        digest = db_manager.content_hash(raw_text)
+        existing = db_manager.find_entry(source_url, digest)
+        if digest in seen or (existing and existing[1] == digest):
+            results.append({"entry_id": existing[0] if existing else None,
+                            "status": "unchanged", "duplicate_of": seen.get(digest),
+                            "new": [], "stale": [], "embedded": 0, "kept": 0, "removed": 0})
+            continue
+        entry_id = existing[0] if existing else None
+        chunks = chunk_text(raw_text)
+        new, stale = diff_chunks(entry_id, chunks)
+        result = {"entry_id": entry_id, "status": "updated" if existing else "new",
+                  "digest": digest, "new": new, "stale": stale, "embedded": len(new),
+                  "kept": len(chunks) - len(new), "removed": len(stale)}
+        seen[digest] = result
+        results.append(result)
+
+    to_embed = [pair for r in results for pair in r["new"]]
+    embeddings = [embedder.encode_cached([c for c, _ in to_embed[i:i + EMBED_BATCH]],
+                                         [d for _, d in to_embed[i:i + EMBED_BATCH]])
+                  for i in range(0, len(to_embed), EMBED_BATCH)]
+
+    # 1. Store entries and chunks in DB first (one transaction); chunk ids key the vectors
+    chunk_ids, stale_ids = [], []
+    with db_manager.transaction():
+        for (source_url, source_type, title, raw_text), r in zip(docs, results):
+            if r["status"] == "unchanged":
+                continue
+            if r["entry_id"] is None:
+                r["entry_id"] = db_manager.add_entry(source_type, source_url, title, raw_text,
+                                                     digest=r["digest"])
+            else:
+                db_manager.update_entry(r["entry_id"], title, raw_text, digest=r["digest"])
+            chunk_ids.extend(db_manager.add_chunks(
+                r["entry_id"], [c for c, _ in r["new"]], [d for _, d in r["new"]]))
+            db_manager.delete_chunks(r["stale"])
+            stale_ids.extend(r["stale"])
+    for r in results:
+        if r.get("duplicate_of"):
+            r["entry_id"] = r["duplicate_of"]["entry_id"]
+
+    # 2. Append to the FAISS index as a delta segment; tombstone replaced chunks
+    if stale_ids:
+        vector_store.remove(stale_ids)
+    if chunk_ids and vector_store.add(chunk_ids, np.vstack(embeddings)) and compact:
+        vector_store.spawn_compaction()
+    return results
+
+
+def _unchanged(entry_id):
+    return {"entry_id": entry_id, "status": "unchanged", "embedded": 0, "kept": 0, "removed": 0}
+
+
+def store_stream(source_url, source_type, title, pieces, file_hash=None, compact=True):
+    """Store a large document from a stream of text pieces (e.g. PDF pages).
+
+    Pieces flow into the chunker, and chunks are embedded and written
+    EMBED_BATCH at a time, so chunk and vector memory stays flat however big
+    the document is. Only the plain text is accumulated, for entries.raw_text.
+    With `file_hash` (see file_digest), a file already ingested with the
+    same bytes is skipped without consuming `pieces` at all.
+    Returns a result dict like store_documents() (compact likewise).
+    """
+    if file_hash:
+        entry_id = db_manager.find_file(source_url, file_hash)
+        if entry_id is not None:
+            return _unchanged(entry_id)
+
+    existing_entry = db_manager.find_entry(source_url, None)
+    if existing_entry:
+        entry_id = existing_entry[0]
     else:
-        index = faiss.IndexFlatL2(dimension)
+        entry_id = db_manager.add_entry(source_type, source_url, title, "", digest="")
+    existing = _chunk_hashes_by_digest(entry_id)
 
-    # 1. Store chunks in DB first
-    for chunk in chunks:
-        db_manager.add_chunk(entry_id, chunk)
+    parts = []
+    text_hash = hashlib.sha256()
 
-    # 2. Add to FAISS index
-    index.add(np.array(embeddings).astype('float32'))
-    faiss.write_index(index, INDEX_PATH)
+    def tee(stream):
+        for piece in stream:
+            parts.append(piece)
+            text_hash.update(piece.encode("utf-8"))
+            yield piece
+
+    added, kept = [], 0
+    try:
+        for batch in chunker.batched(chunker.iter_chunks(tee(pieces)), EMBED_BATCH):
+            new = _take_new(batch, existing)
+            kept += len(batch) - len(new)
+            if not new:
+                continue
+            vectors = embedder.encode_cached([c for c, _ in new], [d for _, d in new])
+            chunk_ids = db_manager.add_chunks(entry_id, [c for c, _ in new], [d for _, d in new])
+            if vector_store.add(chunk_ids, vectors) and compact:
+                vector_store.spawn_compaction()
+            added.extend(chunk_ids)
+        raw_text = "".join(parts)
+        if len(raw_text) < MIN_TEXT_LENGTH:
+            raise ValueError("Failed to extract meaningful text.")
+    except Exception:
+        # Leave a previous version intact; drop a half-written new entry
+        if existing_entry:
+            db_manager.delete_chunks(added)
+        else:
+            db_manager.delete_entry(entry_id)
+        if added:
+            vector_store.remove(added)
+        raise
+
+    embedded = len(added)
+    stale = [chunk_id for ids in existing.values() for chunk_id in ids]
+    digest = text_hash.hexdigest()
+    unchanged = existing_entry is not None and existing_entry[1] == digest
+    with db_manager.transaction():
+        # Same text: keep the entry (and its ingest time) as it is
+        if not unchanged:
+            db_manager.update_entry(entry_id, title, raw_text, digest=digest)
+        db_manager.delete_chunks(stale)
+        if file_hash:
+            db_manager.set_file_hash(entry_id, file_hash)
+    if stale:
+        vector_store.remove(stale)
+
+    if existing_entry:
+        status = "unchanged" if unchanged else "updated"
+    else:
+        status = "new"
+    return {"entry_id": entry_id, "status": status, "embedded": embedded,
+            "kept": kept, "removed": len(stale)}
+
+
+def describe(result):
+    if result["status"] == "unchanged":
+        return "unchanged, skipped"
+    if result["status"] == "updated":
+        return (f"updated: {result['embedded']} chunks embedded, "
+                f"{result['kept']} kept, {result['removed']} removed")
+    return f"{result['embedded']} chunks"
+
+
+def load_url(url):
+    """Fetch a YouTube transcript or web article. Returns (source_type, raw_text)."""
+    if "youtube.com" in url or "youtu.be" in url:
+        return "youtube", fetch_youtube_transcript(url)
+    return "web", fetch_web_article(url)
+
+
+def load_file(path, source_type=None):
+    """Read a PDF or text file. Returns (source_type, raw_text)."""
+    if path.endswith(".pdf"):
+        return "pdf", fetch_pdf_text(path)
+    if path.endswith(".txt"):
+        with open(path, "r") as f:
+            return source_type or "text", f.read()
+    return source_type or "unknown", ""
+
+
+def load_source(source, source_type=None):
+    """Load a URL or file path, raising ValueError if no usable text came back."""
+    if os.path.isfile(source):
+        loaded_type, raw_text = load_file(source, source_type)
+    else:
+        loaded_type, raw_text = load_url(source)
+    if raw_text.startswith(FETCH_ERRORS):
+        raise ValueError(raw_text)
+    if len(raw_text) < MIN_TEXT_LENGTH:
+        raise ValueError("Failed to extract meaningful text.")
+    return loaded_type, raw_text
+
+
+def read_batch_file(path):
+    """One URL or file path per line; blank lines and # comments are skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def list_directory(path):
+    sources = []
+    for root, _, filenames in os.walk(path):
+        for fname in sorted(filenames):
+            if fname.lower().endswith(INGESTABLE_EXTENSIONS):
+                sources.append(os.path.join(root, fname))
+    return sorted(sources)
+
+
+def _extract_pdf(path):
+    """Text of a whole PDF on one core (process pool worker)."""
+    return "".join(iter_pdf_pages(path, workers=1))
+
+
+def ingest_many(sources, source_type=None, workers=FETCH_WORKERS):
+    """Ingest many sources: fetch concurrently, embed in large batches, then
+    commit the DB once and write one index segment for everything except
+    big PDFs, which are streamed afterwards. A due compaction is started
+    once, at the end."""
+    started = time.perf_counter()
+    loaded, failed, file_hashes, skipped = {}, {}, {}, []
+    # Big PDFs are streamed one at a time (their pages already use a process
+    # pool). Small PDFs are extracted one per core, unless the file is
+    # unchanged since its last ingest; everything else is fetched on threads.
+    pdfs = [src for src in sources if src.lower().endswith(".pdf") and os.path.isfile(src)]
+    streamed = [src for src in pdfs if os.path.getsize(src) >= STREAM_PDF_BYTES]
+    small = []
+    for src in pdfs:
+        if src in streamed:
+            continue
+        file_hashes[src] = file_digest(src)
+        entry_id = db_manager.find_file(src, file_hashes[src])
+        if entry_id is None:
+            small.append(src)
+        else:
+            skipped.append((src, "pdf", _unchanged(entry_id)))
+    others = [src for src in sources if src not in set(pdfs)]
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as pdf_pool:
+        futures = {pool.submit(load_source, src, source_type): src for src in others}
+        futures.update({pdf_pool.submit(_extract_pdf, src): src for src in small})
+        for future in as_completed(futures):
+            src = futures[future]
+            try:
+                if src in file_hashes:
+                    raw_text = future.result()
+                    if len(raw_text) < MIN_TEXT_LENGTH:
+                        raise ValueError("Failed to extract meaningful text.")
+                    loaded[src] = ("pdf", raw_text)
+                else:
+                    loaded[src] = future.result()
+            except Exception as e:
+                failed[src] = str(e)
+    fetched = time.perf_counter()
+
+    docs = [(src, *loaded[src]) for src in sources if src in loaded]
+    print(f"🧠 Chunking and embedding {len(docs) + len(streamed)} sources...")
+    results = store_documents([(src, loaded_type, src, raw_text)
+                               for src, loaded_type, raw_text in docs], compact=False)
+    reports = list(skipped)
+    for (src, loaded_type, _), result in zip(docs, results):
+        if src in file_hashes and result["entry_id"] is not None:
+            db_manager.set_file_hash(result["entry_id"], file_hashes[src], src)
+        reports.append((src, loaded_type, result))
+    results.extend(result for _, _, result in skipped)
+    for src in streamed:
+        try:
+            result = store_stream(src, "pdf", src, iter_pdf_pages(src), file_digest(src), compact=False)
+        except Exception as e:
+            failed[src] = str(e)
+            continue
+        reports.append((src, "pdf", result))
+        results.append(result)
+    if vector_store.compaction_due():
+        vector_store.spawn_compaction()
+    finished = time.perf_counter()
+
+    for src, loaded_type, result in reports:
+        print(f"✅ [{loaded_type}] {src} | ID: {result['entry_id']} | {describe(result)}")
+    for src in sources:
+        if src in failed:
+            print(f"❌ {src}: {failed[src]}")
+
+    embedded = sum(r["embedded"] for r in results)
+    elapsed = max(finished - started, 1e-9)
+    print(f"📊 {len(results)}/{len(sources)} sources in {elapsed:.1f}s "
+          f"(fetch {fetched - started:.1f}s, embed+store {finished - fetched:.1f}s) | "
+          f"{len(results) / elapsed:.2f} docs/s, {embedded / elapsed:.1f} chunks/s")
+
+
+def report(result, source_type, title):
+    if result["status"] == "unchanged":
+        print(f"⏭️ Already up to date: {title}")
+    else:
+        print(f"✅ Successfully ingested: {title}")
+    print(f"📊 Source: {source_type} | ID: {result['entry_id']} | {describe(result)}")
 
 
 def main():
@@ -114,47 +461,57 @@ def main():
     parser = argparse.ArgumentParser(description="Morpheus Knowledge Ingestion")
     parser.add_argument("--url", help="URL to ingest (YouTube or Web)")
     parser.add_argument("--file", help="File to ingest (PDF)")
+    parser.add_argument("--batch", metavar="FILE", help="Ingest every URL/path listed in FILE (one per line)")
+    parser.add_argument("--dir", metavar="PATH", help="Ingest every PDF/TXT file under PATH")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="Concurrent fetches in batch mode")
     parser.add_argument("--type", help="Source type (youtube, web, pdf, x)")
     parser.add_argument("--title", help="Override title")
+    parser.add_argument("--chunker", choices=chunker.STRATEGIES, default=chunker.STRATEGY,
+                        help="tokens: sentences packed to the model's token limit; chars: 1000-char windows")
 
     args = parser.parse_args()
+    chunker.STRATEGY = args.chunker
     db_manager.init_db()
 
-    raw_text = ""
-    source_type = args.type or "unknown"
+    if args.batch or args.dir:
+        sources = read_batch_file(args.batch) if args.batch else list_directory(args.dir)
+        if not sources:
+            print("❌ Nothing to ingest.")
+            return
+        ingest_many(sources, args.type, args.workers)
+        return
+
     source_url = args.url or args.file
     title = args.title or source_url
 
-    if args.url:
-        if "youtube.com" in args.url or "youtu.be" in args.url:
-            raw_text = fetch_youtube_transcript(args.url)
-            source_type = "youtube"
-        else:
-            raw_text = fetch_web_article(args.url)
-            source_type = "web"
-    elif args.file:
-        if args.file.endswith(".pdf"):
-            raw_text = fetch_pdf_text(args.file)
-            source_type = "pdf"
-        elif args.file.endswith(".txt"):
-            try:
-                with open(args.file, "r") as f:
-                    raw_text = f.read()
-                source_type = args.type or "text"
-            except Exception as e:
-                print(f"Error reading text file: {e}")
+    if args.file and args.file.endswith(".pdf"):
+        print("🧠 Streaming PDF pages through the chunker...")
+        try:
+            result = store_stream(source_url, "pdf", title, iter_pdf_pages(args.file),
+                                  file_digest(args.file))
+        except Exception as e:
+            print(f"❌ Failed to ingest PDF: {e}")
+            return
+        report(result, "pdf", title)
+        return
+
+    source_type, raw_text = args.type or "unknown", ""
+    try:
+        if args.url:
+            source_type, raw_text = load_url(args.url)
+        elif args.file:
+            source_type, raw_text = load_file(args.file, args.type)
+    except OSError as e:
+        print(f"Error reading text file: {e}")
 
-    if not raw_text or len(raw_text) < 50:
+    if len(raw_text) < MIN_TEXT_LENGTH or raw_text.startswith(FETCH_ERRORS):
         print("❌ Failed to extract meaningful text.")
         return
 
-    entry_id = db_manager.add_entry(source_type, source_url, title, raw_text)
-
-    print(f"🧠 Chunking and Embedding entry {entry_id}...")
-    update_vector_index(entry_id, raw_text)
+    print("🧠 Chunking and Embedding...")
+    result = store_documents([(source_url, source_type, title, raw_text)])[0]
+    report(result, source_type, title)
 
-    print(f"✅ Successfully ingested: {title}")
-    print(f"📊 Source: {source_type} | ID: {entry_id}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""
+Knowledge Base API - Morpheus AI
+Skill: knowledge-base
+
+A long-lived, importable front end to search.py for agents that query the
+knowledge base many times per session:
+
+    from kb import KnowledgeBase
+    kb = KnowledgeBase()
+    kb.search("What did Berman say about vector databases?")
+    kb.stats()
+
+The vector index stays loaded (memory-mapped where FAISS allows) and is only
+re-read when its files change on disk. Query embeddings and result sets are
+kept in LRU caches; result sets are dropped whenever the index or the
+database changes, whichever process made the change.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(__file__))
+import db_manager
+import search as search_module
+
+QUERY_CACHE_SIZE = 512
+RESULT_CACHE_SIZE = 256
+
+
+class LRUCache:
+    """A small LRU mapping with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def normalize(query):
+    """Cache key for a query: whitespace differences don't change the answer."""
+    return " ".join(query.split())
+
+
+class KnowledgeBase:
+    def __init__(self, query_cache_size=QUERY_CACHE_SIZE, result_cache_size=RESULT_CACHE_SIZE):
+        self.embeddings = LRUCache(query_cache_size)
+        self.results = LRUCache(result_cache_size)
+        self.reloads = 0
+        self._lock = threading.RLock()
+        self._parts = None
+        self._deleted = None
+        self._meta = None
+        self._index_signature = None
+        self._data_version = None
+        self._version_conn = None
+
+    def _db_version(self):
+        """PRAGMA data_version on a private connection, which moves on every
+        commit made through any other connection, this process's included."""
+        if not os.path.exists(db_manager.DB_PATH):
+            return None
+        if self._version_conn is None:
+            self._version_conn = sqlite3.connect(db_manager.DB_PATH, check_same_thread=False)
+        return self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _refresh(self):
+        """Drop cached results if the database or index changed since last time."""
+        import vector_store
+
+        index_signature = vector_store.signature()
+        data_version = self._db_version()
+        if index_signature != self._index_signature:
+            self._parts = None  # reloaded lazily by the next vector search
+            self._index_signature = index_signature
+            self.results.clear()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.results.clear()
+
+    def _load_parts(self):
+        import vector_store
+
+        if self._parts is None:
+            self._parts, self._deleted = vector_store.load_parts(mmap=True)
+            self._meta = vector_store.read_meta()
+            self.reloads += 1
+        return self._parts, self._deleted
+
+    def embed(self, query):
+        """The query's embedding, from the cache when it was seen before."""
+        import embedder
+
+        key = normalize(query)
+        vector = self.embeddings.get(key)
+        if vector is None:
+            vector = embedder.encode([key])
+            self.embeddings.put(key, vector)
+        return vector
+
+    def _vector_hits(self, query, limit, chunk_ids=None):
+        import vector_store
+
+        try:
+            parts, deleted = self._load_parts()
+        except vector_store.LegacyIndexError as e:
+            raise LookupError(str(e))
+        if not parts:
+            return []
+        return search_module.rank_vectors(
+            self.embed(query), limit,
+            lambda vector, k, ids: vector_store.search_parts(parts, deleted, vector, k, ids),
+            self._meta, chunk_ids,
+            lambda ids: vector_store.reconstruct_parts(parts, ids))
+
+    def search(self, query, top_k=3, mode="hybrid", source_type=None, since=None, entry_id=None,
+               rerank=False):
+        """Same contract as search.search(): a list of result dicts or a message."""
+        with self._lock:
+            if search_module.is_empty():
+                return "Memory is empty. Please ingest some knowledge first."
+            self._refresh()
+            key = (normalize(query), top_k, mode, source_type, since, entry_id, rerank)
+            results = self.results.get(key)
+            if results is None:
+                hits = search_module.retrieve(key[0], top_k, mode, self._vector_hits,
+                                              source_type=source_type, since=since, entry_id=entry_id,
+                                              rerank=rerank)
+                if isinstance(hits, str):
+                    return hits
+                results = search_module.hydrate(hits)
+                self.results.put(key, results)
+            return [dict(r) for r in results]
+
+    def invalidate(self):
+        """Forget cached results and the loaded index (embeddings stay valid)."""
+        with self._lock:
+            self.results.clear()
+            self._parts = None
+            self._index_signature = None
+
+    def stats(self):
+        return {"query_embeddings": self.embeddings.stats(),
+                "results": self.results.stats(),
+                "index_reloads": self.reloads}
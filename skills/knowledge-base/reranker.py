@@ -0,0 +1,141 @@
+"""
+Cross-encoder re-ranking for the knowledge base.
+
+The first stage (BM25/vector) is cheap but coarse. This scores the top
+candidates against the query jointly with a small cross-encoder, in one
+batch, and re-orders them. The model runs in the embedding daemon when it
+is up (so it stays warm across search.py calls) and in-process otherwise.
+Scores are cached per (query, chunk hash).
+
+Scoring is kept inside a latency budget: the number of uncached pairs sent
+to the model is capped from the measured cost per pair, and a daemon that
+doesn't answer within the budget leaves the first-stage order in place.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import requests
+
+sys.path.append(os.path.dirname(__file__))
+import embedder
+
+RERANK_MODEL = os.environ.get("KB_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CANDIDATES = int(os.environ.get("KB_RERANK_CANDIDATES", 20))
+MAX_CANDIDATES = 50
+BUDGET_MS = float(os.environ.get("KB_RERANK_BUDGET_MS", 250))
+SCORE_CACHE_SIZE = 4096
+
+_model = None
+_model_lock = threading.Lock()
+_daemon_down = False
+_scores = OrderedDict()
+
+stats = {"pairs": 0, "cached": 0, "ms_per_pair": None}
+
+
+def load_model():
+    """Load the cross-encoder once per process."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+            _model = CrossEncoder(RERANK_MODEL)
+    return _model
+
+
+def predict(query, texts):
+    """Score (query, text) pairs in one batch with the local model."""
+    model = load_model()
+    pairs = [(query, text) for text in texts]
+    return np.asarray(model.predict(pairs, batch_size=max(1, len(pairs))), dtype='float32')
+
+
+def _score_remote(query, texts, timeout):
+    """Score via the embedding daemon. Returns None if it is unreachable or
+    too slow for the budget."""
+    global _daemon_down
+    if _daemon_down:
+        return None
+    try:
+        resp = requests.post(f"{embedder.EMBED_URL}/rerank", json={
+            "model": RERANK_MODEL,
+            "query": query,
+            "texts": texts
+        }, timeout=(embedder.CONNECT_TIMEOUT, timeout))
+    except requests.exceptions.Timeout:
+        return None
+    except requests.exceptions.RequestException:
+        _daemon_down = True
+        return None
+    if resp.status_code != 200:
+        print(f"[reranker] daemon refused request: {resp.text}", file=sys.stderr)
+        _daemon_down = True
+        return None
+    return np.asarray(resp.json()["scores"], dtype='float32')
+
+
+def _remember(key, value):
+    _scores[key] = value
+    _scores.move_to_end(key)
+    while len(_scores) > SCORE_CACHE_SIZE:
+        _scores.popitem(last=False)
+
+
+def rerank(query, rows, top_k, budget_ms=BUDGET_MS):
+    """Re-order first-stage candidates by cross-encoder score.
+
+    rows is [(chunk_id, chunk_text, chunk_hash)] in first-stage order.
+    Returns ([(chunk_id, score)] best first, {"scored", "cached", "skipped"}
+    pair counts).
+    Candidates the budget didn't cover keep their place after the scored
+    ones; if scoring can't finish in time the first-stage order stands.
+    """
+    rows = rows[:MAX_CANDIDATES]
+    scores = {}
+    todo = []
+    for chunk_id, text, digest in rows:
+        cached = _scores.get((query, digest))
+        if cached is not None:
+            _scores.move_to_end((query, digest))
+            scores[chunk_id] = cached
+        else:
+            todo.append((chunk_id, text, digest))
+    stats["cached"] += len(scores)
+    counts = {"scored": 0, "cached": len(scores), "skipped": 0}
+
+    # Admit as many uncached pairs as the measured cost per pair allows
+    if stats["ms_per_pair"]:
+        admitted = max(top_k, int(budget_ms / stats["ms_per_pair"]))
+        counts["skipped"] = max(0, len(todo) - admitted)
+        todo = todo[:admitted]
+
+    if todo:
+        texts = [text for _, text, _ in todo]
+        started = time.perf_counter()
+        fresh = _score_remote(query, texts, budget_ms / 1000)
+        if fresh is None and _daemon_down:
+            load_model()  # one-off cost, not part of the per-pair estimate
+            started = time.perf_counter()
+            fresh = predict(query, texts)
+        if fresh is None:
+            counts.update(cached=0, skipped=len(rows))
+            return [(chunk_id, 0.0) for chunk_id, _, _ in rows][:top_k], counts
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        per_pair = elapsed_ms / len(todo)
+        previous = stats["ms_per_pair"]
+        stats["ms_per_pair"] = per_pair if previous is None else 0.7 * previous + 0.3 * per_pair
+        stats["pairs"] += len(todo)
+        counts["scored"] = len(todo)
+        for (chunk_id, _, digest), score in zip(todo, fresh):
+            scores[chunk_id] = float(score)
+            _remember((query, digest), float(score))
+
+    # Sorted by score; unscored candidates follow in first-stage order
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    ranked += [(chunk_id, float("-inf")) for chunk_id, _, _ in rows if chunk_id not in scores]
+    return ranked[:top_k], counts
@@ -1,31 +1,20 @@
-import json
 import os
-import datetime
+import sys
+
+# Shared mission submission library lives at the workspace root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from mission_store import submit_mission
 
-MISSION_DIR = "missions"
 
 def create_scout_mission(topic, reasoning=""):
-    os.makedirs(MISSION_DIR, exist_ok=True)
-    mission_id = f"scout_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    mission = {
-        "id": mission_id,
-        "action": "scout_x",
-        "status": "pending",
-        "data": {
-            "topic": topic,
-            "reasoning": reasoning
-        },
-        "created_at": datetime.datetime.now().isoformat()
-    }
-    
-    filepath = os.path.join(MISSION_DIR, f"{mission_id}.json")
-    with open(filepath, "w") as f:
-        json.dump(mission, f, indent=2)
-    
-    return mission_id
+    # Unique id + temp-file-and-rename: concurrent scouts never collide and
+    # mission_control never reads a half-written file
+    return submit_mission("scout_x", {
+        "topic": topic,
+        "reasoning": reasoning
+    })
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) < 2:
         print("Usage: python scout.py \"topic\" [\"reasoning\"]")
         sys.exit(1)
@@ -1,59 +1,276 @@
+import argparse
+import re
 import sys
 import os
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
 
 # Import local DB manager
 sys.path.append(os.path.dirname(__file__))
 import db_manager
 
-INDEX_PATH = "/root/.openclaw/library/knowledge/vector.index"
-MODEL_NAME = 'all-MiniLM-L6-v2'
+MODES = ("hybrid", "vector", "lexical")
 
+# Reciprocal rank fusion: score = sum(1 / (RRF_K + rank)) over the rankings
+# a chunk appears in. Each retriever contributes CANDIDATE_FACTOR * top_k.
+RRF_K = 60
+CANDIDATE_FACTOR = 4
 
-def search(query, top_k=3):
-    if not os.path.exists(INDEX_PATH):
-        return "Memory is empty. Please ingest some knowledge first."
+# With a quantised index, fetch RERANK_FACTOR x the candidates and re-order
+# them by exact float32 distance (vectors come from the embedding cache).
+EXACT_RERANK = os.environ.get("KB_EXACT_RERANK", "1") == "1"
+RERANK_FACTOR = 4
+
+# Filters matching at most this many chunks are scored exactly; larger ones
+# search the index through an id selector (see rank_vectors).
+FILTER_EXACT_MAX = int(os.environ.get("KB_FILTER_EXACT_MAX", 5000))
+
+SINCE_UNITS = {"h": "hours", "d": "days", "w": "weeks"}
+
+# Milliseconds per stage of the last search (lexical, vector, rerank, hydrate)
+timings = {}
+
+
+def exact_rerank(query_vector, hits, limit):
+    """Re-order [(chunk_id, distance)] by exact L2 distance to the query."""
+    import embedder
+
+    rows = db_manager.get_chunk_texts(chunk_id for chunk_id, _ in hits)
+    if not rows:
+        return hits[:limit]
+    vectors = embedder.encode_cached([text for _, text, _ in rows], [digest for _, _, digest in rows])
+    distances = ((vectors - query_vector.reshape(1, -1)) ** 2).sum(axis=1)
+    order = distances.argsort()[:limit]
+    return [(rows[i][0], float(distances[i])) for i in order]
+
+
+def score_exactly(query_vector, chunk_ids, limit, reconstruct_fn=None):
+    """Rank chunk_ids by exact L2 distance to the query.
+
+    Vectors come from the embedding cache, then from the index through
+    reconstruct_fn(ids) -> {chunk_id: vector}, and only the chunks found in
+    neither are embedded, so a cold or deleted cache doesn't turn one query
+    into thousands of embeddings.
+    """
+    import numpy as np
+    import embedder
+    import embedding_cache
+
+    rows = db_manager.get_chunk_texts(chunk_ids)
+    if not rows:
+        return []
+    cached = embedding_cache.get_many(embedder.MODEL_NAME, [digest for _, _, digest in rows])
+    missing = [chunk_id for chunk_id, _, digest in rows if digest not in cached]
+    stored = reconstruct_fn(missing) if missing and reconstruct_fn else {}
+    rest = [(text, digest) for chunk_id, text, digest in rows
+            if digest not in cached and chunk_id not in stored]
+    if rest:
+        fresh = embedder.encode_cached([text for text, _ in rest], [digest for _, digest in rest])
+        cached.update(zip((digest for _, digest in rest), fresh))
+    vectors = np.vstack([stored[chunk_id] if chunk_id in stored else cached[digest]
+                         for chunk_id, _, digest in rows])
+    distances = ((vectors - query_vector.reshape(1, -1)) ** 2).sum(axis=1)
+    order = distances.argsort()[:limit]
+    return [(rows[i][0], float(distances[i])) for i in order]
+
+
+def rank_vectors(query_vector, limit, search_fn, meta, chunk_ids=None, reconstruct_fn=None):
+    """Nearest chunks via search_fn(query_vector, k, chunk_ids), re-ranked
+    exactly when the index described by `meta` only stores approximate
+    vectors.
+
+    A chunk_ids filter of up to FILTER_EXACT_MAX chunks is scored exactly
+    (see score_exactly). A larger one is searched in the index, and scored
+    exactly after all if the index comes back with fewer than `limit` hits.
+    """
+    import vector_store
+
+    if chunk_ids is not None and len(chunk_ids) <= FILTER_EXACT_MAX:
+        return score_exactly(query_vector, chunk_ids, limit, reconstruct_fn)
+    if not (EXACT_RERANK and vector_store.is_lossy(meta)):
+        hits = search_fn(query_vector, limit, chunk_ids)
+    else:
+        hits = exact_rerank(query_vector, search_fn(query_vector, limit * RERANK_FACTOR, chunk_ids), limit)
+    if chunk_ids is not None and len(hits) < min(limit, len(chunk_ids)):
+        return score_exactly(query_vector, chunk_ids, limit, reconstruct_fn)
+    return hits
+
+
+def vector_hits(query, limit, chunk_ids=None):
+    # Imported here so lexical searches never load FAISS or the model
+    import embedder
+    import vector_store
+
+    if not vector_store.exists():
+        return []
+    query_vector = embedder.encode([query])
+    try:
+        parts, deleted = vector_store.load_parts()
+        return rank_vectors(
+            query_vector, limit,
+            lambda vector, k, ids: vector_store.search_parts(parts, deleted, vector, k, ids),
+            vector_store.read_meta(), chunk_ids,
+            lambda ids: vector_store.reconstruct_parts(parts, ids))
+    except vector_store.LegacyIndexError as e:
+        raise LookupError(str(e))
+
+
+def parse_since(value):
+    """'30d', '12h', '2w' (ago) or an ISO date -> entries.timestamp format (UTC).
 
-    model = SentenceTransformer(MODEL_NAME)
-    query_vector = model.encode([query])
+    Raises argparse.ArgumentTypeError for anything else, so it doubles as
+    the --since argument type.
+    """
+    match = re.fullmatch(r"(\d+)([hdw])", value.strip())
+    try:
+        if match:
+            moment = datetime.now(timezone.utc) - timedelta(**{SINCE_UNITS[match[2]]: int(match[1])})
+        else:
+            moment = datetime.fromisoformat(value.strip())
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value {value!r}: use 30d, 12h, 2w or a date like 2024-05-01")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
 
-    index = faiss.read_index(INDEX_PATH)
-    _, indices = index.search(np.array(query_vector).astype('float32'), top_k)
+
+def fuse(*rankings, k=RRF_K):
+    """Reciprocal rank fusion of several [(chunk_id, score)] lists."""
+    scores = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def retrieve(query, top_k=3, mode="hybrid", vector_fn=vector_hits,
+             source_type=None, since=None, entry_id=None, rerank=False):
+    """Ranked [(chunk_id, score)] for a query, or an error message string.
+
+    vector_fn(query, limit, chunk_ids) supplies the vector ranking, so a
+    long-lived caller can plug in a warm index and cached query embeddings.
+    source_type, since (entries.timestamp format) and entry_id restrict
+    both rankings to matching entries before searching. With rerank, the
+    first stage gathers reranker.CANDIDATES hits and a cross-encoder picks
+    the top_k. Per-stage milliseconds are left in `timings`.
+    """
+    timings.clear()
+    first_k = top_k
+    if rerank:
+        import reranker
+        first_k = min(max(top_k, reranker.CANDIDATES), reranker.MAX_CANDIDATES)
+
+    filters = {"source_type": source_type, "since": since, "entry_id": entry_id}
+    candidates = first_k * CANDIDATE_FACTOR if mode == "hybrid" else first_k
+    lexical, vector = [], []
+    if mode in ("lexical", "hybrid"):
+        started = time.perf_counter()
+        try:
+            lexical = db_manager.lexical_search(query, candidates, **filters)
+        except sqlite3.OperationalError as e:
+            if mode == "lexical":
+                return f"Lexical search unavailable ({e}). Use --mode vector."
+        timings["lexical"] = _elapsed_ms(started)
+    if mode in ("vector", "hybrid"):
+        started = time.perf_counter()
+        chunk_ids = None
+        if any(value is not None for value in filters.values()):
+            chunk_ids = db_manager.filter_chunk_ids(**filters)
+        try:
+            vector = vector_fn(query, candidates, chunk_ids) if chunk_ids != [] else []
+        except LookupError as e:
+            return str(e)
+        timings["vector"] = _elapsed_ms(started)
+
+    hits = fuse(lexical, vector)[:first_k] if mode == "hybrid" else (lexical or vector)
+    if not rerank or not hits:
+        return hits[:top_k]
+
+    started = time.perf_counter()
+    rows = {row[0]: row for row in db_manager.get_chunk_texts(chunk_id for chunk_id, _ in hits)}
+    ranked, counts = reranker.rerank(query, [rows[cid] for cid, _ in hits if cid in rows], top_k)
+    timings["rerank"] = _elapsed_ms(started)
+    timings["rerank_pairs"] = counts
+    return ranked
+
+
+def hydrate(hits):
+    """Turn [(chunk_id, score)] into result dicts, in the same order."""
+    rows = db_manager.get_search_rows(chunk_id for chunk_id, _ in hits)
 
     results = []
-    for idx in indices[0]:
-        # FAISS indices are 0-based
-        # SQLite autoincrement IDs are 1-based (usually)
-        # We assume they were added in the same order
-        chunk_id = int(idx) + 1
-        chunk_data = db_manager.get_chunk(chunk_id)
-
-        if chunk_data:
-            chunk_text, entry_id = chunk_data
-            entry = db_manager.get_entry(entry_id)
-            if entry:
-                results.append({
-                    "id": entry[0],
-                    "type": entry[1],
-                    "url": entry[2],
-                    "title": entry[3],
-                    "chunk": chunk_text,
-                    "full_text_snippet": entry[4][:200] + "..."
-                })
+    for chunk_id, _ in hits:
+        row = rows.get(chunk_id)
+        if row:
+            chunk_text, entry_id, source_type, source_url, title, snippet = row
+            results.append({
+                "id": entry_id,
+                "type": source_type,
+                "url": source_url,
+                "title": title,
+                "chunk": chunk_text,
+                "full_text_snippet": snippet + "..."
+            })
+
+    return results
+
+
+def is_empty():
+    return not os.path.exists(db_manager.DB_PATH) or db_manager.count_chunks() == 0
 
+
+def search(query, top_k=3, mode="hybrid", source_type=None, since=None, entry_id=None,
+           rerank=False):
+    if is_empty():
+        return "Memory is empty. Please ingest some knowledge first."
+
+    hits = retrieve(query, top_k, mode, source_type=source_type, since=since, entry_id=entry_id,
+                    rerank=rerank)
+    if isinstance(hits, str):
+        return hits
+    started = time.perf_counter()
+    results = hydrate(hits)
+    timings["hydrate"] = _elapsed_ms(started)
     return results
 
 
+def format_timings():
+    stages = []
+    for stage in ("lexical", "vector", "rerank", "hydrate"):
+        if stage in timings:
+            stages.append(f"{stage} {timings[stage]:.1f}ms")
+    if "rerank" in timings:
+        pairs = timings["rerank_pairs"]
+        stages[-1 if "hydrate" not in timings else -2] += (
+            f" ({pairs['scored']} pairs scored, {pairs['cached']} cached, "
+            f"{pairs['skipped']} over budget)")
+    return " | ".join(stages)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python search.py \"your query\"")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Morpheus Knowledge Search")
+    parser.add_argument("query", help="What to search for")
+    parser.add_argument("--mode", choices=MODES, default="hybrid",
+                        help="lexical (BM25, no model load), vector (embeddings) or hybrid (both, fused)")
+    parser.add_argument("--type", help="Only entries of this source type (youtube, web, pdf, x)")
+    parser.add_argument("--since", type=parse_since, help="Only entries ingested since: 30d, 12h, 2w or a date (2024-05-01)")
+    parser.add_argument("--entry", type=int, help="Only chunks of this entry ID")
+    parser.add_argument("--rerank", action="store_true",
+                        help="Re-rank the top candidates with a cross-encoder (KB_RERANK_CANDIDATES, default 20)")
+    parser.add_argument("--timings", action="store_true", help="Print per-stage latency")
+    args = parser.parse_args()
 
-    search_query = sys.argv[1]
+    search_query = args.query
     print(f"🔍 Searching for: {search_query}")
-    search_results = search(search_query)
+    search_results = search(search_query, mode=args.mode, source_type=args.type,
+                            since=args.since,
+                            entry_id=args.entry, rerank=args.rerank)
 
     if isinstance(search_results, str):
         print(search_results)
@@ -64,3 +281,5 @@ if __name__ == "__main__":
             print(f"Source: {r['type']} ({r['url']})")
             print(f"Chunk: {r['chunk']}")
             print("-" * 20)
+    if args.timings:
+        print(f"⏱️ {format_timings()}")
@@ -0,0 +1,548 @@
+"""
+Vector store for the knowledge base.
+
+Wraps the FAISS index in an IndexIDMap2 keyed by the real chunks.id from
+SQLite, so search hits resolve to the right text no matter what order chunks
+were inserted, deleted or re-ingested in.
+
+The index engine is tiered by corpus size: a brute-force flat index while the
+library is small, HNSW once it crosses HNSW_THRESHOLD vectors, and IVF-PQ past
+IVFPQ_THRESHOLD. KB_INDEX_ENGINE pins one engine instead of "auto", and
+KB_INDEX_STORAGE picks float32, float16, SQ8 or PQ codes for the base. The
+engine and storage in use are recorded in a JSON sidecar next to the index.
+
+Writes are append-only. Each ingest drops a small flat delta segment into
+vector.index.d/ and deletes append chunk ids to a tombstone file; nothing
+rewrites the base index except compaction, which folds segments and
+tombstones into it (and re-tiers it) in the background. Search merges
+results across the base and all segments. An flock on vector.index.lock
+keeps concurrent writers, readers and the compactor from stepping on each
+other.
+"""
+
+import heapq
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+INDEX_PATH = "/root/.openclaw/library/knowledge/vector.index"
+
+INDEX_ENGINE = os.environ.get("KB_INDEX_ENGINE", "auto")
+HNSW_THRESHOLD = int(os.environ.get("KB_HNSW_THRESHOLD", 20000))
+IVFPQ_THRESHOLD = int(os.environ.get("KB_IVFPQ_THRESHOLD", 500000))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.environ.get("KB_HNSW_EF_SEARCH", 64))
+IVF_NPROBE = int(os.environ.get("KB_IVF_NPROBE", 16))
+PQ_SUBVECTORS = 48
+# IVF-PQ k-means needs a decent sample; below this a pinned ivfpq stays flat.
+IVFPQ_MIN_TRAIN = 10000
+
+# IVF-PQ centroids go stale as the corpus grows; retrain once it has grown
+# this many times past the size it was trained on.
+RETRAIN_FACTOR = 4
+
+ENGINES = ("flat", "hnsw", "ivfpq")
+
+# How flat and HNSW bases store vectors: raw float32, float16 or 8-bit
+# scalar quantisation (2x / 4x smaller), or product quantisation (PQ
+# subvectors of one byte each). IVF-PQ is always PQ.
+STORAGE = os.environ.get("KB_INDEX_STORAGE", "f32")
+STORAGES = ("f32", "fp16", "sq8", "pq")
+
+# Ask for a background compaction once this many delta segments pile up.
+COMPACT_SEGMENTS = int(os.environ.get("KB_COMPACT_SEGMENTS", 8))
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock. The knowledge base runs in the Linux container, so
+    # this only matters for local experiments with a single writer.
+    fcntl = None
+
+
+class LegacyIndexError(Exception):
+    """The index on disk is keyed by FAISS position, not by chunk id."""
+
+
+def _meta_path():
+    return f"{INDEX_PATH}.json"
+
+
+def _segment_dir():
+    return f"{INDEX_PATH}.d"
+
+
+def _tombstone_path():
+    return f"{INDEX_PATH}.deleted"
+
+
+@contextmanager
+def _locked(exclusive, name="lock", blocking=True):
+    """Hold an flock next to the index. Yields False if non-blocking and busy."""
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    with open(f"{INDEX_PATH}.{name}", "a") as handle:
+        if fcntl is None:
+            yield True
+            return
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(handle, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def read_meta():
+    try:
+        with open(_meta_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"engine": "flat", "trained_on": 0}
+
+
+def _write_meta(meta):
+    tmp_path = f"{_meta_path()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, _meta_path())
+
+
+def choose_engine(count, meta=None):
+    """Pick the engine for a corpus of `count` vectors. An engine forced by
+    `index_tool.py rebuild --engine` stays pinned in the sidecar."""
+    if meta and meta.get("pinned"):
+        return meta["engine"]
+    if INDEX_ENGINE != "auto":
+        if INDEX_ENGINE == "ivfpq" and count < IVFPQ_MIN_TRAIN:
+            return "flat"
+        return INDEX_ENGINE
+    if count >= IVFPQ_THRESHOLD:
+        return "ivfpq"
+    if count >= HNSW_THRESHOLD:
+        return "hnsw"
+    return "flat"
+
+
+def _ivf_lists(count):
+    # ~4*sqrt(n) lists, with enough points per list to train k-means
+    return max(16, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def _pq_subvectors(dimension):
+    m = min(PQ_SUBVECTORS, dimension)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def factory_string(engine, dimension, count, storage="f32"):
+    codes = {"f32": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{_pq_subvectors(dimension)}"}
+    if storage not in codes:
+        raise ValueError(f"Unknown index storage: {storage} (choose from {', '.join(STORAGES)})")
+    if engine == "flat":
+        return f"IDMap2,{codes[storage]}"
+    if engine == "hnsw":
+        return f"IDMap2,HNSW{HNSW_M}" + ("" if storage == "f32" else f"_{codes[storage]}")
+    if engine == "ivfpq":
+        return f"IDMap2,IVF{_ivf_lists(count)},PQ{_pq_subvectors(dimension)}"
+    raise ValueError(f"Unknown index engine: {engine} (choose from {', '.join(ENGINES)})")
+
+
+def is_lossy(meta):
+    """True when the base stores approximations of the vectors, so exact
+    re-ranking of its top candidates can improve the order."""
+    return meta.get("engine") == "ivfpq" or meta.get("storage", "f32") != "f32"
+
+
+def tune(index, ef_search=None, nprobe=None):
+    """Apply query-time parameters; each only applies to its own engine."""
+    params = faiss.ParameterSpace()
+    for name, value in (("efSearch", ef_search or HNSW_EF_SEARCH),
+                        ("nprobe", nprobe or IVF_NPROBE)):
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+    return index
+
+
+def build_index(ids, vectors, engine=None, pinned=False, storage=None):
+    """Build a fresh index over (ids, vectors), training it if needed."""
+    vectors = np.asarray(vectors, dtype='float32')
+    engine = engine or choose_engine(len(vectors))
+    storage = storage or STORAGE
+    for needs_training, name in ((engine == "ivfpq", "ivfpq"), (storage == "pq", "pq storage")):
+        if needs_training and len(vectors) < IVFPQ_MIN_TRAIN:
+            raise ValueError(f"{name} needs at least {IVFPQ_MIN_TRAIN} vectors to train, got {len(vectors)}")
+    index = faiss.index_factory(vectors.shape[1],
+                                factory_string(engine, vectors.shape[1], len(vectors), storage))
+    if engine == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, _as_ids(ids))
+    meta = {"engine": engine, "storage": storage, "trained_on": len(vectors), "pinned": pinned}
+    return tune(index), meta
+
+
+def new_index(dimension):
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+
+def _read_index(path, mmap=False):
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            pass  # index type (or FAISS build) can't be mapped; read it normally
+    if index is None:
+        index = faiss.read_index(path)
+    if not hasattr(index, "id_map"):
+        raise LegacyIndexError(
+            f"{INDEX_PATH} maps FAISS positions to chunk ids. "
+            "Run 'python index_tool.py rebuild' to migrate it."
+        )
+    return tune(index)
+
+
+def load_index():
+    """Load the base index from disk. Returns None if there isn't one yet."""
+    if not os.path.exists(INDEX_PATH):
+        return None
+    return _read_index(INDEX_PATH)
+
+
+def _segment_paths():
+    try:
+        names = sorted(os.listdir(_segment_dir()))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(_segment_dir(), n) for n in names if n.endswith(".index")]
+
+
+def _read_tombstones(limit=None):
+    try:
+        with open(_tombstone_path(), "rb") as f:
+            data = f.read() if limit is None else f.read(limit)
+    except FileNotFoundError:
+        return np.zeros(0, dtype='int64')
+    return np.frombuffer(data[:len(data) // 8 * 8], dtype='int64')
+
+
+def load_parts(mmap=False):
+    """Load the base index and all delta segments, plus the tombstoned ids.
+
+    With mmap=True the files are memory-mapped where FAISS supports it, so
+    a long-lived reader shares pages with the OS cache instead of copying.
+    """
+    with _locked(exclusive=False):
+        paths = ([INDEX_PATH] if os.path.exists(INDEX_PATH) else []) + _segment_paths()
+        return [_read_index(p, mmap) for p in paths], _read_tombstones()
+
+
+def signature():
+    """Cheap fingerprint of the on-disk index (base, sidecar, segments and
+    tombstones); it changes whenever any writer touches one of them."""
+    stamps = []
+    for path in [INDEX_PATH, _meta_path(), _tombstone_path()] + _segment_paths():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamps.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(stamps)
+
+
+def exists():
+    return os.path.exists(INDEX_PATH) or bool(_segment_paths())
+
+
+def count():
+    """Live vectors across base and segments (tombstones subtracted)."""
+    parts, deleted = load_parts()
+    return max(0, sum(p.ntotal for p in parts) - len(np.unique(deleted)))
+
+
+def save_index(index, meta=None):
+    """Write the index atomically so readers never see a half-written file."""
+    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    tmp_path = f"{INDEX_PATH}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, INDEX_PATH)
+    if meta is not None:
+        _write_meta(meta)
+
+
+def _as_ids(ids):
+    return np.asarray(list(ids), dtype='int64')
+
+
+def exact_vectors(index):
+    """Return (ids, vectors) stored in the index, or None if it only keeps
+    lossy codes (IVF-PQ) and the vectors must be re-embedded instead."""
+    inner = faiss.downcast_index(index.index)
+    if not isinstance(inner, (faiss.IndexFlat, faiss.IndexHNSWFlat)):
+        return None
+    ids = faiss.vector_to_array(index.id_map).astype('int64')
+    return ids, inner.reconstruct_n(0, inner.ntotal)
+
+
+def needs_rebuild(total=None, meta=None):
+    """True when the base should move to another engine or be retrained."""
+    meta = meta or read_meta()
+    total = count() if total is None else total
+    if choose_engine(total, meta) != meta.get("engine", "flat"):
+        return True
+    return (meta.get("engine") == "ivfpq"
+            and total > RETRAIN_FACTOR * meta.get("trained_on", 0))
+
+
+def memory_bytes(index):
+    """Approximate in-memory footprint (the serialized size)."""
+    return int(faiss.serialize_index(index).size)
+
+
+def stored_vectors():
+    """Live (ids, vectors) across base and segments, or None when the base
+    only keeps lossy codes and the vectors must be re-embedded instead."""
+    parts, deleted = load_parts()
+    if not parts:
+        return np.zeros(0, dtype='int64'), np.zeros((0, 0), dtype='float32')
+    stored = [exact_vectors(p) for p in parts]
+    if any(s is None for s in stored):
+        return None
+    ids = np.concatenate([s[0] for s in stored])
+    vectors = np.vstack([s[1] for s in stored])
+    keep = ~np.isin(ids, deleted)
+    return ids[keep], vectors[keep]
+
+
+def add(ids, vectors):
+    """Append vectors keyed by chunk id as a new delta segment.
+
+    Only the new vectors are written. Returns True once enough segments have
+    piled up that a compaction is due.
+    """
+    vectors = np.asarray(vectors, dtype='float32')
+    segment = new_index(vectors.shape[1])
+    segment.add_with_ids(vectors, _as_ids(ids))
+
+    os.makedirs(_segment_dir(), exist_ok=True)
+    name = f"seg-{time.time_ns():020d}-{os.getpid()}.index"
+    tmp_path = os.path.join(_segment_dir(), f".{name}.tmp")
+    faiss.write_index(segment, tmp_path)
+    with _locked(exclusive=True):
+        os.replace(tmp_path, os.path.join(_segment_dir(), name))
+        return compaction_due()
+
+
+def compaction_due():
+    """True once enough delta segments have piled up to compact them."""
+    return len(_segment_paths()) >= COMPACT_SEGMENTS
+
+
+def remove(ids):
+    """Tombstone vectors by chunk id; compaction drops them for good.
+    Returns how many ids were tombstoned."""
+    ids = _as_ids(ids)
+    if not len(ids):
+        return 0
+    with _locked(exclusive=True):
+        with open(_tombstone_path(), "ab") as f:
+            f.write(ids.tobytes())
+    return len(ids)
+
+
+def snapshot():
+    """Note which segments and tombstones exist now, so replace_base() only
+    retires what the new base actually covers."""
+    with _locked(exclusive=False):
+        path = _tombstone_path()
+        return _segment_paths(), os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def replace_base(index, meta, snap):
+    """Install a new base index and retire the segments/tombstones in `snap`."""
+    segment_paths, tombstone_bytes = snap
+    with _locked(exclusive=True):
+        save_index(index, meta)
+        for path in segment_paths:
+            os.remove(path)
+        # Keep tombstones written after the snapshot
+        late = _read_tombstones()[tombstone_bytes // 8:]
+        with open(_tombstone_path(), "wb") as f:
+            f.write(late.tobytes())
+
+
+def compact(reembed=None):
+    """Fold delta segments and tombstones into the base index.
+
+    Re-tiers the base when the live count crosses an engine threshold. When
+    the base only holds lossy codes and needs retraining, `reembed()` must
+    supply fresh (ids, vectors). Returns False if another compaction is
+    already running or there was nothing to do.
+    """
+    with _locked(exclusive=True, name="compact", blocking=False) as acquired:
+        if not acquired:
+            return False
+
+        snap = snapshot()
+        segment_paths, tombstone_bytes = snap
+        deleted = _read_tombstones(tombstone_bytes)
+        if not segment_paths and not len(deleted):
+            return False
+        with _locked(exclusive=False):
+            base = load_index()
+            segments = [_read_index(p) for p in segment_paths]
+
+        new_ids, new_vectors = [np.zeros(0, dtype='int64')], []
+        for segment in segments:
+            ids, vectors = exact_vectors(segment)
+            keep = ~np.isin(ids, deleted)
+            new_ids.append(ids[keep])
+            new_vectors.append(vectors[keep])
+        new_ids = np.concatenate(new_ids)
+
+        if base is None:
+            if not new_vectors:
+                return False
+            base = new_index(new_vectors[0].shape[1])
+            meta = {"engine": "flat", "trained_on": 0}
+        else:
+            meta = read_meta()
+
+        # Ids actually in the base that must go: tombstoned ones, and
+        # re-ingested ones about to be added again (so none lands twice)
+        base_ids = faiss.vector_to_array(base.id_map).astype('int64')
+        stale = np.unique(np.concatenate([deleted, new_ids]))
+        stale = stale[np.isin(stale, base_ids)]
+
+        live = base.ntotal - len(stale) + len(new_ids)
+        engine = choose_engine(live, meta)
+        retier = (engine != meta.get("engine")
+                  or (engine == "ivfpq" and live > RETRAIN_FACTOR * meta.get("trained_on", 0)))
+
+        if not retier and len(stale):
+            try:
+                base.remove_ids(stale)
+            except RuntimeError:
+                # HNSW graphs can't drop nodes; rebuild without them
+                retier = True
+
+        if retier:
+            stored = exact_vectors(base)
+            if stored is None:
+                if reembed is None:
+                    raise ValueError("Base index holds lossy codes; compaction needs reembed()")
+                ids, vectors = reembed()
+            else:
+                replaced = np.isin(stored[0], new_ids)
+                ids = np.concatenate([stored[0][~replaced], new_ids])
+                vectors = np.vstack([stored[1][~replaced]] + new_vectors)
+            keep = ~np.isin(ids, deleted)
+            if engine != meta.get("engine"):
+                print(f"🔁 Re-indexing {int(keep.sum())} vectors: {meta.get('engine')} -> {engine}")
+            base, meta = build_index(ids[keep], vectors[keep], engine=engine,
+                                     pinned=meta.get("pinned", False), storage=meta.get("storage"))
+        elif len(new_ids):
+            base.add_with_ids(np.vstack(new_vectors), new_ids)
+
+        replace_base(base, meta, snap)
+        return True
+
+
+def spawn_compaction():
+    """Run `index_tool.py compact` detached so the caller doesn't wait."""
+    tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "index_tool.py")
+    subprocess.Popen([sys.executable, tool, "compact"], stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def _search_params(index, selector, selected):
+    """SearchParameters restricting `index` to `selector` (`selected` ids),
+    carrying the engine's own query-time knobs (per-call params replace the
+    index's). The knobs are widened by the filter's selectivity: a filter
+    keeping 1 vector in 20 needs ~20x the candidates to fill the same k."""
+    inner = faiss.downcast_index(index.index)
+    scale = max(1.0, index.ntotal / max(selected, 1))
+    if isinstance(inner, faiss.IndexHNSW):
+        ef_search = min(max(index.ntotal, HNSW_EF_SEARCH), math.ceil(HNSW_EF_SEARCH * scale))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    if isinstance(inner, faiss.IndexIVF):
+        nprobe = min(inner.nlist, math.ceil(IVF_NPROBE * scale))
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def reconstruct_parts(parts, chunk_ids):
+    """{chunk_id: vector} for the ids the parts can give back.
+
+    Flat and HNSW parts return their stored vector (an approximation under
+    fp16/SQ8/PQ storage); IVF-PQ can't reconstruct by id, so its ids are
+    left out and the caller has to embed them.
+    """
+    wanted = {int(i) for i in chunk_ids}
+    found = {}
+    for part in parts:
+        if not wanted:
+            break
+        for chunk_id in wanted.intersection(faiss.vector_to_array(part.id_map).tolist()):
+            try:
+                found[chunk_id] = part.reconstruct(chunk_id)
+            except RuntimeError:
+                continue  # IVF keeps no id -> position map
+            wanted.discard(chunk_id)
+    return found
+
+
+def search(query_vector, top_k, chunk_ids=None):
+    """Return [(chunk_id, distance), ...] for the nearest chunks, merged
+    across the base index and all delta segments. `chunk_ids` restricts
+    the search to those chunks."""
+    parts, deleted = load_parts()
+    return search_parts(parts, deleted, query_vector, top_k, chunk_ids)
+
+
+def search_parts(parts, deleted, query_vector, top_k, chunk_ids=None):
+    """search() over parts already loaded with load_parts().
+
+    A filtered search on HNSW or IVF can still come back with fewer than
+    top_k hits; callers fall back to scoring the filter exactly.
+    """
+    query = np.asarray(query_vector, dtype='float32').reshape(1, -1)
+    deleted = set(deleted.tolist())
+    # Over-fetch so tombstoned hits don't leave us short
+    fetch = top_k + len(deleted)
+    selector = None
+    if chunk_ids is not None:
+        # The ids come from SQLite, so they are all live: no over-fetch
+        selector = faiss.IDSelectorBatch(_as_ids(chunk_ids))
+        fetch = top_k
+
+    best = {}
+    for part in parts:
+        if part.ntotal == 0:
+            continue
+        params = _search_params(part, selector, len(chunk_ids)) if selector is not None else None
+        distances, ids = part.search(query, min(fetch, part.ntotal), params=params)
+        for i, d in zip(ids[0], distances[0]):
+            i = int(i)
+            if i == -1 or i in deleted:
+                continue
+            if i not in best or d < best[i]:
+                best[i] = float(d)
+    return heapq.nsmallest(top_k, best.items(), key=lambda hit: hit[1])
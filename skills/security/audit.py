@@ -15,13 +15,13 @@ import requests
 import datetime
 import re
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import ollama_client
+
 sys.stdout.reconfigure(encoding='utf-8')
 
 ABSPATH = os.path.abspath(__file__)
 WORKSPACE = os.path.dirname(os.path.dirname(os.path.dirname(ABSPATH)))
-OLLAMA_URL = os.environ.get(
-    "OLLAMA_API_URL", "http://host.docker.internal:11434/api/generate"
-)
 MODEL = os.environ.get("MODEL_NAME", "llama3.1:8b")
 FINDINGS_FILE = os.path.join(WORKSPACE, "memory", "security-findings.json")
 
@@ -131,13 +131,8 @@ def run_perspective(name: str, description: str, files: list) -> str:
     )
 
     try:
-        resp = requests.post(OLLAMA_URL, json={
-            "model": MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "options": {"num_ctx": 8192, "temperature": 0}
-        }, timeout=120)
-        return resp.json().get("response", "").strip()
+        return ollama_client.generate(prompt, model=MODEL, timeout=120,
+                                      options={"num_ctx": 8192, "temperature": 0}).strip()
     except Exception as e:
         return f"[error running {name} perspective: {e}]"
 
@@ -0,0 +1,181 @@
+"""
+Scanner state database for the urgent-email skill.
+
+Holds:
+  seen      message ids already scanned, kept for SEEN_TTL_DAYS
+  accounts  per-account high-water mark: the newest message time seen, so
+            fetches only need mail newer than the last scan
+  verdicts  urgency decisions the LLM has already made, keyed by a hash of
+            the normalised (sender, subject, snippet), so thread replies
+            and repeat senders aren't sent to the model again
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+WORKSPACE = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DB_PATH = os.path.join(WORKSPACE, "memory", "email_scan.db")
+
+# Seen ids are forgotten after this long; it only has to outlast the window
+# a fetch can reach back (the high-water mark minus HIGH_WATER_SLACK)
+SEEN_TTL_DAYS = int(os.environ.get("SCANNER_SEEN_TTL_DAYS", 30))
+# Fetch from this far before the high-water mark, for mail that is delivered
+# late; the seen set drops the repeats
+HIGH_WATER_SLACK = datetime.timedelta(hours=1)
+
+# Cached verdicts older than this are asked again
+VERDICT_TTL_DAYS = int(os.environ.get("SCANNER_VERDICT_TTL_DAYS", 30))
+
+# SQLite caps bound parameters per statement (999 on older builds).
+MAX_PARAMS = 900
+
+# "Re: Fwd: RE[2]: subject" -> "subject"
+REPLY_PREFIX = re.compile(r'^\s*((re|fw|fwd|aw|wg|sv)(\[\d+\])?\s*:\s*)+', re.IGNORECASE)
+ADDRESS = re.compile(r'<([^>]+)>')
+
+_conn = None
+
+
+def get_connection():
+    """The process's connection, opened (and the schema created) on first use."""
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        _conn = sqlite3.connect(DB_PATH, timeout=30)
+        _conn.execute('PRAGMA journal_mode=WAL')
+        _conn.execute('PRAGMA synchronous=NORMAL')
+        init_db(_conn)
+    return _conn
+
+
+def init_db(conn):
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS seen (
+                uid TEXT PRIMARY KEY,
+                account TEXT,
+                seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_seen_time ON seen(seen_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS accounts (
+                account TEXT PRIMARY KEY,
+                high_water TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS verdicts (
+                key TEXT PRIMARY KEY,
+                urgent INTEGER NOT NULL,
+                model TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+
+def _in_batches(conn, sql, keys, *params):
+    keys = list(keys)
+    for start in range(0, len(keys), MAX_PARAMS):
+        batch = keys[start:start + MAX_PARAMS]
+        yield from conn.execute(sql.format(marks=",".join("?" * len(batch))), batch + list(params))
+
+
+def unseen(uids):
+    """The subset of uids not scanned within SEEN_TTL_DAYS."""
+    uids = set(uids)
+    seen = {uid for (uid,) in _in_batches(get_connection(),
+                                          'SELECT uid FROM seen WHERE uid IN ({marks})', uids)}
+    return uids - seen
+
+
+def mark_seen(items):
+    """Record [(uid, account)] as scanned and forget ids past their TTL."""
+    conn = get_connection()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO seen (uid, account) VALUES (?, ?)', items)
+        conn.execute("DELETE FROM seen WHERE seen_at < datetime('now', ?)",
+                     (f"-{SEEN_TTL_DAYS} days",))
+
+
+def get_high_water():
+    """{account: aware UTC datetime of the newest message seen}."""
+    rows = get_connection().execute('SELECT account, high_water FROM accounts WHERE high_water IS NOT NULL')
+    return {account: datetime.datetime.fromisoformat(mark) for account, mark in rows}
+
+
+def fetch_since(marks):
+    """{account: datetime} to fetch from: each mark minus HIGH_WATER_SLACK."""
+    return {account: mark - HIGH_WATER_SLACK for account, mark in marks.items()}
+
+
+def update_high_water(marks):
+    """Advance accounts' marks to {account: datetime} (never moves back)."""
+    conn = get_connection()
+    current = get_high_water()
+    with conn:
+        for account, mark in marks.items():
+            if account not in current or mark > current[account]:
+                conn.execute('''
+                    INSERT OR REPLACE INTO accounts (account, high_water, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (account, mark.astimezone(datetime.timezone.utc).isoformat()))
+
+
+def migrate_state_file(path):
+    """Import seen_ids from the old JSON state file, once.
+
+    The file is renamed to <path>.migrated afterwards. Returns the number
+    of ids imported.
+    """
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            seen_ids = json.load(f).get("seen_ids", [])
+    except (ValueError, OSError, AttributeError):
+        return 0
+    # Old ids are "<type>_<account>_<message id>"; the account is kept as-is
+    mark_seen([(uid, None) for uid in seen_ids])
+    os.replace(path, path + ".migrated")
+    return len(seen_ids)
+
+
+def _normalise(text):
+    return " ".join(text.lower().split())
+
+
+def verdict_key(sender, subject, snippet, model=""):
+    """Cache key: the sender's address, the subject without reply/forward
+    prefixes and the snippet, case- and whitespace-folded. The model is part
+    of the key so switching models doesn't reuse its predecessor's answers."""
+    match = ADDRESS.search(sender)
+    address = match.group(1) if match else sender
+    parts = (_normalise(address), _normalise(REPLY_PREFIX.sub("", subject)), _normalise(snippet), model)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_verdicts(keys):
+    """{key: urgent} for the keys with a fresh cached verdict."""
+    rows = _in_batches(get_connection(), '''
+        SELECT key, urgent FROM verdicts
+        WHERE key IN ({marks}) AND created_at >= datetime('now', ?)
+    ''', keys, f"-{VERDICT_TTL_DAYS} days")
+    return {key: bool(urgent) for key, urgent in rows}
+
+
+def put_verdicts(items, model=""):
+    """Cache [(key, urgent)] and drop verdicts past their TTL."""
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO verdicts (key, urgent, model, created_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', [(key, int(urgent), model) for key, urgent in items])
+        conn.execute("DELETE FROM verdicts WHERE created_at < datetime('now', ?)",
+                     (f"-{VERDICT_TTL_DAYS} days",))
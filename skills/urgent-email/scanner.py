@@ -17,20 +17,41 @@ import sys
 import json
 import os
 import datetime
-import requests
+import re
+import sqlite3
+import threading
+import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import scan_db
+
+# Shared Ollama client (server from OLLAMA_URL) lives at the workspace root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import ollama_client
 
 sys.stdout.reconfigure(encoding='utf-8')
 
 # Paths (relative to workspace root, which is the working dir when called via exec)
 WORKSPACE = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-STATE_FILE  = os.path.join(WORKSPACE, "memory", "email_scan_state.json")
+STATE_FILE  = os.path.join(WORKSPACE, "memory", "email_scan_state.json")  # pre-SQLite seen ids
 NOISE_FILE  = os.path.join(WORKSPACE, "memory", "noise_senders.json")
 URGENT_FILE = os.path.join(WORKSPACE, "memory", "urgent_senders.json")
 
-OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://host.docker.internal:11434/api/generate")
 MODEL      = "llama3.1:8b"
 
+# Batch classification: up to BATCH_SIZE emails per Ollama request, at most
+# CONCURRENCY requests in flight (ollama_client's global cap also applies).
+# Batches whose reply can't be parsed are retried one email at a time.
+BATCH_SIZE  = int(os.environ.get("SCANNER_BATCH_SIZE", 10))
+CONCURRENCY = int(os.environ.get("SCANNER_CONCURRENCY", 2))
+SNIPPET_CHARS = 300
+
+# Seconds to wait for all accounts' mail
+FETCH_DEADLINE = float(os.environ.get("SCANNER_FETCH_DEADLINE", 60))
+
 WAKING_START = 8   # 08:00 GMT
 WAKING_END   = 23  # 23:00 GMT
 
@@ -64,39 +85,210 @@ def is_waking_hours():
     return WAKING_START <= now.hour < WAKING_END
 
 
-def is_noise(sender: str, noise_list: list) -> bool:
-    s = sender.lower()
-    for pattern in DEFAULT_NOISE + noise_list:
-        if pattern.lower() in s:
-            return True
-    return False
+# Deterministic pre-classifier: obvious cases settled without the model.
+# Kept deliberately narrow; anything ambiguous still goes to the LLM.
+URGENT_PATTERNS = re.compile(
+    r"\b(final (notice|reminder)|overdue|payment (failed|declined|unsuccessful)"
+    r"|account (suspended|locked|compromised)|unusual (sign[- ]in|activity)"
+    r"|security alert|fraud alert|court (date|hearing)|eviction|bailiff)\b", re.IGNORECASE)
+ROUTINE_PATTERNS = re.compile(
+    r"\b(newsletter|webinar|weekly digest|\d+% off|flash sale|black friday"
+    r"|has (been )?(shipped|dispatched|delivered)|order confirmation|your receipt"
+    r"|view (it )?in (your )?browser|unsubscribe)\b", re.IGNORECASE)
+
+
+def pre_classify(sender: str, subject: str, snippet: str):
+    """True/False when a rule settles the email, None when the LLM should decide."""
+    if URGENT_PATTERNS.search(subject):
+        return True
+    if ROUTINE_PATTERNS.search(subject) or ROUTINE_PATTERNS.search(snippet):
+        return False
+    return None
+
+
+URGENCY_RULES = (
+    "An email is URGENT if it requires action within 24 hours, involves money, legal matters, "
+    "health, account security, or is from a real person (not a company) asking something important."
+)
+
+# Per-scan classifier counters (see classify_batch)
+stats = {"emails": 0, "llm_calls": 0, "batches": 0, "fallbacks": 0, "seconds": 0.0}
+_stats_lock = threading.Lock()
 
 
-def is_always_urgent(sender: str, urgent_list: list) -> bool:
-    s = sender.lower()
-    return any(u.lower() in s for u in urgent_list)
+def _generate(prompt, num_ctx, timeout, json_format=False):
+    with _stats_lock:
+        stats["llm_calls"] += 1
+    return ollama_client.generate(prompt, model=MODEL, timeout=timeout,
+                                  options={"num_ctx": num_ctx, "temperature": 0},
+                                  format="json" if json_format else None)
 
 
-def classify(subject: str, snippet: str, sender: str) -> bool:
-    """Ask local Ollama if this email is urgent. Returns True if urgent."""
+def classify(subject: str, snippet: str, sender: str):
+    """Ask local Ollama if this email is urgent. Returns True if urgent,
+    False if not, and None if Ollama failed or gave no usable answer."""
     prompt = (
         "You are an email urgency classifier. Reply with only 'URGENT' or 'NOT_URGENT'.\n\n"
-        "An email is URGENT if it requires action within 24 hours, involves money, legal matters, "
-        "health, account security, or is from a real person (not a company) asking something important.\n\n"
+        f"{URGENCY_RULES}\n\n"
         f"From: {sender}\nSubject: {subject}\nPreview: {snippet}\n\nClassification:"
     )
     try:
-        resp = requests.post(OLLAMA_URL, json={
-            "model": MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "options": {"num_ctx": 512, "temperature": 0}
-        }, timeout=30)
-        result = resp.json().get("response", "").strip().upper()
-        return "URGENT" in result
+        result = _generate(prompt, 512, 30).strip().upper()
     except Exception as e:
         print(f"[classifier error] {e}", file=sys.stderr)
+        return None
+    if "NOT_URGENT" in result:
         return False
+    if "URGENT" in result:
+        return True
+    return None
+
+
+def _batch_prompt(emails):
+    items = [{"i": i,
+              "from": e.get("from", ""),
+              "subject": e.get("subject", ""),
+              "preview": e.get("snippet", "")[:SNIPPET_CHARS]}
+             for i, e in enumerate(emails)]
+    return (
+        "You are an email urgency classifier.\n\n"
+        f"{URGENCY_RULES}\n\n"
+        "Classify every email in this JSON array:\n"
+        f"{json.dumps(items, ensure_ascii=False)}\n\n"
+        'Reply with only a JSON object of the form {"labels": [{"i": 0, "label": "URGENT"}, ...]} '
+        'with one entry per email, in order, each label "URGENT" or "NOT_URGENT".'
+    )
+
+
+def parse_labels(reply, count):
+    """[bool] * count from a batch reply, or None if it doesn't cover every email."""
+    try:
+        labels = json.loads(reply)["labels"]
+        verdicts = {int(item["i"]): str(item["label"]).strip().upper() for item in labels}
+    except (ValueError, KeyError, TypeError):
+        return None
+    if sorted(verdicts) != list(range(count)):
+        return None
+    if any(label not in ("URGENT", "NOT_URGENT") for label in verdicts.values()):
+        return None
+    return [verdicts[i] == "URGENT" for i in range(count)]
+
+
+def _classify_chunk(emails):
+    prompt = _batch_prompt(emails)
+    try:
+        # Room for the prompt plus ~20 tokens of answer per email
+        reply = _generate(prompt, min(8192, 1024 + len(prompt) // 3 + 32 * len(emails)),
+                          30 + 10 * len(emails), json_format=True)
+    except Exception as e:
+        # Ollama down, hung or failing: asking once per email would only
+        # fail n more times, so the whole chunk stays unknown
+        print(f"[classifier error] {e}", file=sys.stderr)
+        return [None] * len(emails)
+    verdicts = parse_labels(reply, len(emails))
+    if verdicts is None:
+        with _stats_lock:
+            stats["fallbacks"] += 1
+        verdicts = [classify(e.get("subject", ""), e.get("snippet", ""), e.get("from", ""))
+                    for e in emails]
+    return verdicts
+
+
+def classify_batch(emails, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    """Urgency for many emails: [True/False/None], in order.
+
+    Emails go to Ollama BATCH_SIZE at a time as one JSON-array prompt, with
+    up to `concurrency` requests in flight; a batch whose reply isn't a
+    complete set of labels falls back to one request per email. None means
+    the model couldn't be asked (see classify).
+    """
+    if not emails:
+        return []
+    started = time.perf_counter()
+    chunks = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(_classify_chunk, chunks))
+    stats["emails"] += len(emails)
+    stats["batches"] += len(chunks)
+    stats["seconds"] += time.perf_counter() - started
+    return [verdict for chunk in results for verdict in chunk]
+
+
+def format_stats():
+    rate = stats["emails"] / stats["seconds"] if stats["seconds"] else 0.0
+    saved = stats["emails"] - stats["llm_calls"]
+    return (f"Classified {stats['emails']} emails in {stats['seconds']:.1f}s "
+            f"({rate:.1f} emails/s), {stats['llm_calls']} LLM calls "
+            f"({saved} saved, {stats['fallbacks']} batch fallbacks)")
+
+
+def message_time(message):
+    """When a message was received (aware UTC), from whichever field the
+    bridge supplied, or None."""
+    value = message.get("internalDate")
+    if value:
+        try:
+            return datetime.datetime.fromtimestamp(int(value) / 1000, datetime.timezone.utc)
+        except (TypeError, ValueError):
+            pass
+    value = message.get("date")
+    if not value:
+        return None
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc)
+
+
+def settle(emails):
+    """Urgency for emails past the sender lists: ([bool or None], [source]).
+
+    Each email is settled by the first of: the keyword rules, the verdict
+    cache, the LLM (batched). LLM verdicts are cached for next time. An
+    email the LLM couldn't classify comes back as (None, "unknown") and is
+    not cached, so a later scan asks again.
+    """
+    verdicts, sources = [None] * len(emails), [None] * len(emails)
+    keys = {}
+    for i, e in enumerate(emails):
+        sender, subject, snippet = e.get("from", ""), e.get("subject", ""), e.get("snippet", "")
+        verdict = pre_classify(sender, subject, snippet)
+        if verdict is not None:
+            verdicts[i], sources[i] = verdict, "rules"
+        else:
+            keys[i] = scan_db.verdict_key(sender, subject, snippet, MODEL)
+
+    try:
+        cached = scan_db.get_verdicts(set(keys.values()))
+    except sqlite3.Error as e:
+        print(f"[verdict cache unavailable] {e}", file=sys.stderr)
+        cached = {}
+    for i, key in keys.items():
+        if key in cached:
+            verdicts[i], sources[i] = cached[key], "cache"
+
+    todo = [i for i in keys if sources[i] is None]
+    fresh = classify_batch([emails[i] for i in todo])
+    for i, verdict in zip(todo, fresh):
+        verdicts[i], sources[i] = verdict, "llm" if verdict is not None else "unknown"
+    try:
+        scan_db.put_verdicts([(keys[i], verdicts[i]) for i in todo if sources[i] == "llm"], MODEL)
+    except sqlite3.Error as e:
+        print(f"[verdict cache unavailable] {e}", file=sys.stderr)
+    return verdicts, sources
+
+
+def format_settled(settled):
+    total = sum(settled.values())
+    shares = " | ".join(f"{'LLM' if source == 'llm' else source} {count} ({100 * count / total:.0f}%)"
+                        for source, count in settled.items())
+    return f"Settled {total} emails: {shares}"
 
 
 def scan():
@@ -104,53 +296,111 @@ def scan():
         print("HEARTBEAT_OK (outside waking hours)")
         return
 
-    # Import mail_bridge from workspace root
+    # Import mail_bridge and the shared helpers from workspace root
     sys.path.insert(0, WORKSPACE)
-    from mail_bridge import fetch_all_recent_emails
+    import mail_bridge
+    from fetch_orchestrator import fetch_all_emails
+    from sender_match import SenderMatcher
 
-    state        = load_json(STATE_FILE, {"seen_ids": []})
-    noise_list   = load_json(NOISE_FILE, [])
-    urgent_list  = load_json(URGENT_FILE, [])
+    # Compiled once per scan, not per email
+    noise         = SenderMatcher(DEFAULT_NOISE + load_json(NOISE_FILE, []))
+    always_urgent = SenderMatcher(load_json(URGENT_FILE, []))
 
+    migrated = scan_db.migrate_state_file(STATE_FILE)
+    if migrated:
+        print(f"Imported {migrated} seen ids from {os.path.basename(STATE_FILE)}")
+    since = scan_db.fetch_since(scan_db.get_high_water())
+
+    stats.update(emails=0, llm_calls=0, batches=0, fallbacks=0, seconds=0.0)
     print(f"Scanning all accounts at {datetime.datetime.utcnow().strftime('%H:%M UTC')}...")
-    emails = fetch_all_recent_emails(max_results_per_account=10)
+    # Accounts are fetched concurrently; one that misses the deadline is
+    # reported and picked up by the next scan (its high-water mark stays put)
+    emails, missing = fetch_all_emails(mail_bridge, 10, since=since, deadline=FETCH_DEADLINE)
+    for note in missing:
+        print(f"  {note}")
+
+    # Global unique ID check: one indexed lookup for the whole fetch
+    def unique_id(e):
+        return f"{e.get('type', 'unknown')}_{e.get('account', 'unknown')}_{e['id']}"
+    new_ids = scan_db.unseen(unique_id(e) for e in emails)
 
     urgent_found = []
+    to_classify  = []
+    settled      = {"lists": 0, "rules": 0, "cache": 0, "llm": 0}
+    checked      = 0
+    scanned      = []
 
     for email in emails:
-        msg_id  = email["id"]
         sender  = email.get("from", "")
         subject = email.get("subject", "")
-        snippet = email.get("snippet", "")
         acc_id  = email.get("account", "unknown")
         acc_type = email.get("type", "unknown")
+        account = f"{acc_type}:{acc_id}"
 
-        # Global unique ID check
-        unique_id = f"{acc_type}_{acc_id}_{msg_id}"
-
-        if unique_id in state["seen_ids"]:
+        uid = unique_id(email)
+        if uid not in new_ids:
             continue
+        new_ids.discard(uid)  # the same message listed twice
 
-        # Mark as seen
-        state["seen_ids"].append(unique_id)
-        state["seen_ids"] = state["seen_ids"][-1000:]  # cap size
+        # Marked as seen once the scan's verdicts are in. The high-water
+        # mark is only a hint for the next fetch: anything fetched and not
+        # seen before is scanned, however old
+        scanned.append((email, uid, account))
+        checked += 1
 
-        if is_noise(sender, noise_list):
+        if noise.matches(sender):
             print(f"  [noise]  {sender[:50]}")
             continue
 
-        if is_always_urgent(sender, urgent_list):
+        if always_urgent.matches(sender):
             print(f"  [always-urgent] {sender[:50]}: {subject[:60]}")
             urgent_found.append(email)
             continue
 
-        is_urg = classify(subject, snippet, sender)
-        label  = "URGENT" if is_urg else "ok"
-        print(f"  [{label}] ({acc_type}:{acc_id}) {sender[:40]}: {subject[:50]}")
+        to_classify.append(email)
+
+    verdicts, sources = settle(to_classify)
+    retry = set()
+    for email, is_urg, source in zip(to_classify, verdicts, sources):
+        if is_urg is None:
+            # Classifier unavailable: left unseen for the next scan
+            retry.add(id(email))
+        label  = "URGENT" if is_urg else "ok" if is_urg is not None else "??"
+        via    = "" if source == "llm" else f" ({source})"
+        print(f"  [{label}] ({email.get('type', 'unknown')}:{email.get('account', 'unknown')}) "
+              f"{email.get('from', '')[:40]}: {email.get('subject', '')[:50]}{via}")
         if is_urg:
             urgent_found.append(email)
-
-    save_json(STATE_FILE, state)
+    settled["lists"] = checked - len(to_classify)
+    for source in sources:
+        settled[source] = settled.get(source, 0) + 1
+    if checked:
+        print(f"  {format_settled(settled)}")
+    if "llm" in sources:
+        print(f"  {format_stats()}")
+
+    # Unclassified mail isn't marked seen, and its account's mark doesn't
+    # move past it, so the next fetch still reaches it
+    seen_now, newest, held = [], {}, {}
+    for email, uid, account in scanned:
+        received = message_time(email)
+        if id(email) in retry:
+            # Oldest unclassified message per account (None: time unknown)
+            if received is None or held.get(account, received) is None:
+                held[account] = None
+            else:
+                held[account] = min(received, held.get(account, received))
+            continue
+        seen_now.append((uid, account))
+        if received is not None:
+            newest[account] = max(received, newest.get(account, received))
+    for account, oldest in held.items():
+        if oldest is None:
+            newest.pop(account, None)
+        elif account in newest:
+            newest[account] = min(newest[account], oldest)
+    scan_db.mark_seen(seen_now)
+    scan_db.update_high_water(newest)
 
     if urgent_found:
         print("\n--- URGENT EMAILS ---")